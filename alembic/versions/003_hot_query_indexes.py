@@ -0,0 +1,54 @@
+"""Indexes for hot subscription and tag queries
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "003"
+down_revision: Union[str, None] = "002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction; build without blocking writes on live tables.
+    with op.get_context().autocommit_block():
+        # Active-subscription lookups: WHERE user_id = ? AND status = ? ORDER BY end_date DESC.
+        op.create_index(
+            "ix_subscriptions_user_status_end",
+            "subscriptions",
+            ["user_id", "status", sa.text("end_date DESC")],
+            postgresql_concurrently=True,
+        )
+        # Expiry scan: status = 'active' AND end_date <= now().
+        op.create_index(
+            "ix_subscriptions_active_end_date",
+            "subscriptions",
+            ["end_date"],
+            postgresql_where=sa.text("status = 'active'"),
+            postgresql_concurrently=True,
+        )
+        # Tag segments: tags @> ARRAY[...].
+        op.create_index(
+            "ix_users_tags",
+            "users",
+            ["tags"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+        # Leading column of ix_subscriptions_user_status_end.
+        op.drop_index("ix_subscriptions_user_id", table_name="subscriptions", postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index("ix_subscriptions_user_id", "subscriptions", ["user_id"], postgresql_concurrently=True)
+        op.drop_index("ix_users_tags", table_name="users", postgresql_concurrently=True)
+        op.drop_index("ix_subscriptions_active_end_date", table_name="subscriptions", postgresql_concurrently=True)
+        op.drop_index("ix_subscriptions_user_status_end", table_name="subscriptions", postgresql_concurrently=True)
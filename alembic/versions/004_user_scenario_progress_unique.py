@@ -0,0 +1,42 @@
+"""One progress row per user and scenario
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "004"
+down_revision: Union[str, None] = "003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep the most recently updated row of any duplicates before adding the unique index.
+    op.execute(
+        """
+        DELETE FROM user_scenario_progress p
+        USING user_scenario_progress newer
+        WHERE p.user_id = newer.user_id
+          AND p.scenario_id = newer.scenario_id
+          AND (coalesce(p.updated_at, '-infinity'), p.id) < (coalesce(newer.updated_at, '-infinity'), newer.id)
+        """
+    )
+    # Conflict target of the batched progress upsert.
+    op.create_index(
+        "uq_user_scenario_progress_user_scenario",
+        "user_scenario_progress",
+        ["user_id", "scenario_id"],
+        unique=True,
+    )
+    # Leading column of the unique index.
+    op.drop_index("ix_user_scenario_progress_user_id", table_name="user_scenario_progress")
+
+
+def downgrade() -> None:
+    op.create_index("ix_user_scenario_progress_user_id", "user_scenario_progress", ["user_id"], unique=False)
+    op.drop_index("uq_user_scenario_progress_user_scenario", table_name="user_scenario_progress")
@@ -2,6 +2,11 @@ import logging
 
 from fastapi import APIRouter
 
+from app.bot.update_queue import get_update_queue
+from app.config import get_settings
+from app.core.payment_stream import stream_stats
+from app.core.scenario_delays import delay_stats
+
 router = APIRouter(tags=["health"])
 logger = logging.getLogger(__name__)
 
@@ -14,3 +19,24 @@ async def health() -> dict:
 @router.get("/ready")
 async def ready() -> dict:
     return {"ready": True}
+
+
+@router.get("/metrics")
+async def metrics() -> dict:
+    queue = get_update_queue()
+    try:
+        delayed = await delay_stats()
+    except Exception as e:
+        logger.warning("Delayed step stats unavailable: %s", e)
+        delayed = None
+    payments = None
+    if get_settings().payment_webhook_mode == "stream":
+        try:
+            payments = await stream_stats()
+        except Exception as e:
+            logger.warning("Payment stream stats unavailable: %s", e)
+    return {
+        "update_queue": queue.stats() if queue else None,
+        "scenario_delays": delayed,
+        "payment_stream": payments,
+    }
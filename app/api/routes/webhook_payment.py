@@ -5,7 +5,14 @@ from fastapi import APIRouter, Request, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
-from app.core.payments import process_payment_webhook, idempotency_check, PaymentWebhookPayload
+from app.core.entitlements import invalidate_committed
+from app.core.payments import (
+    is_payment_processed,
+    mark_payment_processed,
+    payload_from_webhook,
+    process_payment_webhook,
+)
+from app.core.payment_stream import append_payment_event
 from app.config import get_settings
 
 router = APIRouter(prefix="/webhook", tags=["payment"])
@@ -39,25 +46,30 @@ async def payment_webhook(
         logger.warning("Invalid payment webhook signature")
         raise HTTPException(status_code=403, detail="Invalid signature")
     data = await request.json()
-    payload = PaymentWebhookPayload(
-        provider=settings.payment_provider,
-        external_id=data.get("id") or data.get("payment_id") or str(data.get("external_id", "")),
-        status=data.get("status", "").lower(),
-        amount=data.get("amount"),
-        currency=data.get("currency", "RUB"),
-        user_telegram_id=data.get("user_telegram_id") or data.get("metadata", {}).get("telegram_id"),
-    )
+    payload = payload_from_webhook(data, settings.payment_provider)
     if not payload.external_id or not payload.status:
         raise HTTPException(status_code=400, detail="Missing id or status")
-    if await idempotency_check(payload.provider, payload.external_id):
+    if settings.payment_webhook_mode == "stream":
+        # Processed in batches by the payment stream consumer.
+        try:
+            await append_payment_event(payload.provider, body)
+        except Exception as e:
+            logger.error("Payment event %s not queued: %s", payload.external_id, e)
+            raise HTTPException(status_code=503, detail="Temporarily unavailable")
+        return {"ok": True, "queued": True}
+    cache = settings.payment_idempotency_cache
+    if cache and await is_payment_processed(payload.provider, payload.external_id):
         logger.info("Payment webhook idempotent skip: %s", payload.external_id)
         return {"ok": True, "processed": False}
     try:
+        # Postgres is the idempotency guard: the payment, subscription and invite outbox event
+        # are committed together, and a duplicate event claims nothing.
         telegram_id = await process_payment_webhook(db, payload)
-        if telegram_id is not None:
-            from app.tasks.after_payment import send_subscription_invite
-            send_subscription_invite.delay(telegram_id)
-        return {"ok": True, "processed": True}
+        await db.commit()
+        await invalidate_committed(db)
     except Exception as e:
         logger.exception("Payment webhook processing failed: %s", e)
         raise HTTPException(status_code=500, detail="Processing failed")
+    if cache and telegram_id is not None:
+        await mark_payment_processed(payload.provider, payload.external_id)
+    return {"ok": True, "processed": telegram_id is not None}
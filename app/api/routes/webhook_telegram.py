@@ -1,12 +1,12 @@
 import logging
 from typing import Any
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
+from aiogram import Dispatcher
 from aiogram.types import Update
 from fastapi import APIRouter, Request, Response, Header, HTTPException
 
+from app.bot.loader import get_bot
+from app.bot.update_queue import get_update_queue
 from app.config import get_settings
 
 router = APIRouter(prefix="/webhook", tags=["telegram"])
@@ -14,13 +14,6 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
-def get_bot() -> Bot:
-    return Bot(
-        token=settings.telegram_bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-
-
 def get_dp() -> Dispatcher:
     from app.bot.loader import get_dispatcher
     return get_dispatcher()
@@ -37,6 +30,13 @@ async def telegram_webhook(
         raise HTTPException(status_code=403, detail="Invalid secret")
     body = await request.json()
     update = Update.model_validate(body)
+    queue = get_update_queue()
+    if queue is not None:
+        if not queue.submit(update):
+            # Non-2xx makes Telegram redeliver later instead of us buffering without bound.
+            logger.warning("Update queue full, rejecting update %s", update.update_id)
+            raise HTTPException(status_code=503, detail="Busy")
+        return {"ok": True}
     dp = get_dp()
     bot = get_bot()
     await dp.feed_webhook_update(bot, update)
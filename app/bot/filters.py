@@ -1,31 +1,34 @@
+from typing import Optional
+
 from aiogram.filters import BaseFilter
 from aiogram.types import Message, CallbackQuery
 
 from app.config import get_settings
-from app.db.session import async_session_maker
-from app.db.models import User
+from app.core.users import UserRecord, get_cached_user
 from app.db.models.user import UserRole
-from sqlalchemy import select
 
 settings = get_settings()
 
+ADMIN_IDS = frozenset(settings.admin_ids_list)
+MANAGER_ROLES = frozenset((UserRole.manager, UserRole.admin))
+
 
 class IsAdmin(BaseFilter):
     async def __call__(self, event: Message | CallbackQuery) -> bool:
         user = event.from_user
         if not user:
             return False
-        return user.id in settings.admin_ids_list
+        return user.id in ADMIN_IDS
 
 
 class IsManager(BaseFilter):
-    async def __call__(self, event: Message | CallbackQuery) -> bool:
+    async def __call__(self, event: Message | CallbackQuery, db_user: Optional[UserRecord] = None) -> bool:
         user = event.from_user
         if not user:
             return False
-        if user.id in settings.admin_ids_list:
+        if user.id in ADMIN_IDS:
             return True
-        async with async_session_maker() as session:
-            result = await session.execute(select(User).where(User.telegram_id == user.id))
-            u = result.scalar_one_or_none()
-            return u is not None and u.role in (UserRole.manager, UserRole.admin)
+        # db_user is resolved (from the user cache) by the outer UserContextMiddleware;
+        # a permission check never creates users itself.
+        record = db_user or get_cached_user(user.id)
+        return record is not None and record.role in MANAGER_ROLES
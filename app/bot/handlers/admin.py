@@ -4,13 +4,17 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
 from app.bot.filters import IsAdmin, IsManager
+from app.config import get_settings
+from app.core.users import invalidate_user
 from app.db.session import async_session_maker
 from app.db.models import User, Subscription, Broadcast
 from app.db.models.subscription import SubscriptionStatus
+from app.db.models.user import UserRole
 from sqlalchemy import select, func
 
 router = Router()
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 admin_filter = IsAdmin()
 manager_filter = IsManager()
@@ -81,6 +85,7 @@ async def cmd_add_tag(message: Message) -> None:
         if tag not in user.tags:
             user.tags = list(user.tags) + [tag]
             await session.commit()
+            invalidate_user(telegram_id)
         await message.answer(f"Тег {tag} добавлен пользователю {telegram_id}.")
 
 
@@ -104,9 +109,39 @@ async def cmd_remove_tag(message: Message) -> None:
             return
         user.tags = [t for t in user.tags if t != tag]
         await session.commit()
+        invalidate_user(telegram_id)
         await message.answer(f"Тег {tag} удалён у пользователя {telegram_id}.")
 
 
+@router.message(Command("set_role"), admin_filter)
+async def cmd_set_role(message: Message) -> None:
+    parts = message.text.split()
+    if len(parts) < 3:
+        await message.answer("Использование: /set_role <telegram_id> <user|manager|admin>")
+        return
+    try:
+        telegram_id = int(parts[1])
+        role = UserRole(parts[2].strip().lower())
+    except ValueError:
+        await message.answer("telegram_id должен быть числом, роль — user, manager или admin.")
+        return
+    async with async_session_maker() as session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        user = result.scalar_one_or_none()
+        if not user:
+            await message.answer("Пользователь не найден.")
+            return
+        user.role = role
+        await session.commit()
+        # Only this process's cache is cleared: other workers pick up the new role once
+        # their cached record expires (USER_CACHE_TTL).
+        invalidate_user(telegram_id)
+        await message.answer(
+            f"Роль {role.value} назначена пользователю {telegram_id}. "
+            f"В остальных процессах бота изменение вступит в силу в течение {settings.user_cache_ttl} с."
+        )
+
+
 @router.message(Command("run_scenario"), admin_filter)
 async def cmd_run_scenario(message: Message) -> None:
     parts = message.text.split()
@@ -119,13 +154,15 @@ async def cmd_run_scenario(message: Message) -> None:
     except ValueError:
         await message.answer("scenario_id и telegram_id должны быть числами.")
         return
-    from app.db.models import Scenario
     from app.core.subscription import has_active_subscription
-    from app.core.scenarios import get_first_step, send_step
+    from app.core.scenarios import ScenarioValidationError, get_compiled_scenario, start_scenario
     from app.bot.loader import get_bot
     async with async_session_maker() as session:
-        result = await session.execute(select(Scenario).where(Scenario.id == scenario_id, Scenario.is_active == True))
-        scenario = result.scalar_one_or_none()
+        try:
+            scenario = await get_compiled_scenario(session, scenario_id)
+        except ScenarioValidationError as e:
+            await message.answer(f"Сценарий содержит ошибку: {e}")
+            return
         if not scenario:
             await message.answer("Сценарий не найден или неактивен.")
             return
@@ -137,14 +174,40 @@ async def cmd_run_scenario(message: Message) -> None:
         if scenario.subscription_required and not await has_active_subscription(session, user.id):
             await message.answer("У пользователя нет активной подписки.")
             return
-        steps = scenario.json_structure.get("steps", [])
-        first = get_first_step(steps)
-        if not first:
+        if not scenario.first:
             await message.answer("В сценарии нет шагов.")
             return
         bot = get_bot()
-        await send_step(bot, telegram_id, first)
-        await message.answer(f"Сценарий «{scenario.name}» запущен для {telegram_id}, отправлен первый шаг.")
+        if await start_scenario(session, bot, scenario, user.id, telegram_id):
+            await message.answer(f"Сценарий «{scenario.name}» запущен для {telegram_id}, отправлен первый шаг.")
+        else:
+            await message.answer(
+                f"Сценарий «{scenario.name}» запущен для {telegram_id}, "
+                f"первый шаг будет отправлен через {int(scenario.first.delay)} с."
+            )
+
+
+@router.message(Command("stop_scenario"), admin_filter)
+async def cmd_stop_scenario(message: Message) -> None:
+    parts = message.text.split()
+    if len(parts) < 3:
+        await message.answer("Использование: /stop_scenario <scenario_id> <telegram_id>")
+        return
+    try:
+        scenario_id = int(parts[1])
+        telegram_id = int(parts[2])
+    except ValueError:
+        await message.answer("scenario_id и telegram_id должны быть числами.")
+        return
+    from app.core.scenario_delays import cancel_delayed_step
+    async with async_session_maker() as session:
+        result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+        user_id = result.scalar_one_or_none()
+    if user_id is None:
+        await message.answer("Пользователь не найден.")
+        return
+    await cancel_delayed_step(user_id, scenario_id)
+    await message.answer(f"Отложенные шаги сценария {scenario_id} для {telegram_id} отменены.")
 
 
 @router.message(Command("create_tariff"), admin_filter)
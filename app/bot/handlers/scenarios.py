@@ -0,0 +1,51 @@
+import logging
+
+from aiogram import Bot, Router, F
+from aiogram.types import CallbackQuery
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.scenarios import (
+    SCENARIO_CALLBACK_PREFIX,
+    ScenarioValidationError,
+    advance_scenario,
+    get_compiled_scenario,
+    parse_scenario_callback,
+)
+from app.core.users import UserRecord
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+# Кнопки переходов сценариев: callback_data = sc:<scenario_id>:<on_callback>
+@router.callback_query(F.data.startswith(SCENARIO_CALLBACK_PREFIX))
+async def scenario_transition(
+    callback: CallbackQuery,
+    bot: Bot,
+    db_user: UserRecord,
+    db_session: AsyncSession,
+    has_subscription: bool,
+) -> None:
+    parsed = parse_scenario_callback(callback.data)
+    if parsed is None:
+        await callback.answer()
+        return
+    scenario_id, on_callback = parsed
+    try:
+        scenario = await get_compiled_scenario(db_session, scenario_id)
+    except ScenarioValidationError as e:
+        logger.error("Scenario %s is invalid: %s", scenario_id, e)
+        scenario = None
+    if scenario is None:
+        await callback.answer("Сценарий больше недоступен.", show_alert=True)
+        return
+    if scenario.subscription_required and not has_subscription:
+        await callback.answer("Этот сценарий доступен только с активной подпиской.", show_alert=True)
+        return
+    step = await advance_scenario(
+        db_session, bot, scenario, db_user.id, callback.from_user.id, on_callback,
+    )
+    if step is None:
+        await callback.answer("Эта кнопка уже неактуальна.")
+        return
+    await callback.answer()
@@ -2,7 +2,7 @@ import logging
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart, Command
 
 from app.bot.keyboards import (
@@ -13,6 +13,7 @@ from app.bot.keyboards import (
     subscription_plans_keyboard,
     trainings_keyboard,
 )
+from app.services.file_ids import send_cached_media
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -164,12 +165,11 @@ async def trainings_price(callback: CallbackQuery) -> None:
     await callback.answer()
     back_kb = back_to_trainings_keyboard()
     if PRICE_PHOTO_PATH.is_file():
-        photo = FSInputFile(PRICE_PHOTO_PATH)
-        await callback.message.answer_photo(
+        await send_cached_media(PRICE_PHOTO_PATH, "photo", lambda photo: callback.message.answer_photo(
             photo=photo,
             caption=PRICE_ABONEMENT_MESSAGE,
             reply_markup=back_kb,
-        )
+        ))
     else:
         await callback.message.answer(
             PRICE_ABONEMENT_MESSAGE,
@@ -200,12 +200,11 @@ async def trainings_trainer(callback: CallbackQuery) -> None:
     await callback.answer()
     back_kb = back_to_trainings_keyboard()
     if TRAINER_PHOTO_PATH.is_file():
-        photo = FSInputFile(TRAINER_PHOTO_PATH)
-        await callback.message.answer_photo(
+        await send_cached_media(TRAINER_PHOTO_PATH, "photo", lambda photo: callback.message.answer_photo(
             photo=photo,
             caption=TRAINER_MESSAGE,
             reply_markup=back_kb,
-        )
+        ))
     else:
         await callback.message.answer(
             TRAINER_MESSAGE,
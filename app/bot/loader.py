@@ -25,22 +25,30 @@ def get_bot() -> Bot:
     return _bot
 
 
+async def close_bot() -> None:
+    global _bot
+    bot, _bot = _bot, None
+    if bot is not None:
+        await bot.session.close()
+
+
 def get_storage() -> RedisStorage:
-    from redis.asyncio import Redis
-    return RedisStorage.from_url(settings.redis_url)
+    from app.services.redis_client import get_redis
+    # FSM state shares the process-wide pool instead of opening its own.
+    return RedisStorage(redis=get_redis())
 
 
 def get_dispatcher() -> Dispatcher:
     global _dp
     if _dp is None:
         _dp = Dispatcher(storage=get_storage())
-        from app.bot.handlers import user, admin
-        from app.bot.middlewares.user_db import UserDbMiddleware
-        from app.bot.middlewares.subscription import SubscriptionMiddleware
-        _dp.message.middleware(UserDbMiddleware())
-        _dp.callback_query.middleware(UserDbMiddleware())
-        _dp.message.middleware(SubscriptionMiddleware())
-        _dp.callback_query.middleware(SubscriptionMiddleware())
+        from app.bot.handlers import user, admin, scenarios
+        from app.bot.middlewares.user_db import SubscriptionContextMiddleware, UserContextMiddleware
+        # Outer: filters run before inner middlewares and need db_user too.
+        for observer in (_dp.message, _dp.callback_query):
+            observer.outer_middleware(UserContextMiddleware())
+            observer.middleware(SubscriptionContextMiddleware())
         _dp.include_router(user.router)
         _dp.include_router(admin.router)
+        _dp.include_router(scenarios.router)
     return _dp
@@ -0,0 +1,135 @@
+"""
+Bounded in-process queue of Telegram updates for the fast-ack webhook mode.
+
+Updates are grouped by user (falling back to chat): a user's updates are handled strictly one
+after another, in arrival order, while different users are processed concurrently by the pool.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+logger = logging.getLogger(__name__)
+
+ProcessFn = Callable[[Update], Awaitable[Any]]
+
+
+def update_key(update: Update) -> Hashable:
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        # Update types newer than this aiogram version: no user to group by.
+        return ("update", update.update_id)
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return ("user", user.id)
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return ("chat", chat.id)
+    return ("update", update.update_id)
+
+
+class UpdateQueue:
+    def __init__(self, workers: int, max_depth: int) -> None:
+        self.workers = workers
+        self.max_depth = max_depth
+        self._pending: dict[Hashable, deque[tuple[Update, float]]] = {}
+        self._scheduled: set[Hashable] = set()
+        self._ready: asyncio.Queue[Hashable] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._depth = 0
+        self._in_flight = 0
+        self._peak_depth = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._last_wait = 0.0
+
+    def start(self, process: ProcessFn) -> None:
+        self._tasks = [asyncio.create_task(self._worker(process)) for _ in range(self.workers)]
+        logger.info("Update queue started: workers=%s max_depth=%s", self.workers, self.max_depth)
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + drain_timeout
+        while (self._depth or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._depth:
+            logger.warning("Update queue stopped with %s updates not processed", self._depth)
+
+    def submit(self, update: Update) -> bool:
+        """Enqueue without waiting; False when the queue is full (caller should push back)."""
+        if self._depth >= self.max_depth:
+            self._rejected += 1
+            return False
+        key = update_key(update)
+        self._pending.setdefault(key, deque()).append((update, time.monotonic()))
+        self._depth += 1
+        self._peak_depth = max(self._peak_depth, self._depth)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self, process: ProcessFn) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._pending[key]
+            update, enqueued_at = pending.popleft()
+            self._depth -= 1
+            self._in_flight += 1
+            self._last_wait = time.monotonic() - enqueued_at
+            try:
+                await process(update)
+                self._processed += 1
+            except Exception as e:
+                self._failed += 1
+                logger.exception("Update %s failed: %s", update.update_id, e)
+            finally:
+                self._in_flight -= 1
+            if pending:
+                # Back of the line, so one chatty user cannot starve the others.
+                self._ready.put_nowait(key)
+            else:
+                del self._pending[key]
+                self._scheduled.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._depth,
+            "max_depth": self.max_depth,
+            "in_flight": self._in_flight,
+            "peak_depth": self._peak_depth,
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "last_wait_ms": round(self._last_wait * 1000, 1),
+        }
+
+
+_queue: Optional[UpdateQueue] = None
+
+
+def get_update_queue() -> Optional[UpdateQueue]:
+    return _queue
+
+
+async def start_update_queue(process: ProcessFn, workers: int, max_depth: int) -> UpdateQueue:
+    global _queue
+    _queue = UpdateQueue(workers, max_depth)
+    _queue.start(process)
+    return _queue
+
+
+async def stop_update_queue() -> None:
+    global _queue
+    queue, _queue = _queue, None
+    if queue is not None:
+        await queue.stop()
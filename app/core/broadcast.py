@@ -1,37 +1,236 @@
+import asyncio
 import logging
+from collections.abc import AsyncIterator
 from datetime import datetime, timezone
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Optional
 
-from sqlalchemy import select
+from sqlalchemy import exists, func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models import User, Broadcast
+from app.db.models import User, Broadcast, BroadcastDelivery
 from app.db.models.subscription import SubscriptionStatus
-from app.db.models.broadcast import BroadcastSegment, BroadcastStatus
+from app.db.models.broadcast import BroadcastSegment, BroadcastStatus, DeliveryStatus
 from app.db.models import Subscription
+from app.db.session import async_session_maker
+from app.services.file_ids import get_file_id, media_key, remember_file_id
+from app.services.telegram_api import ApiResult, copy_message, send_media, send_message_result
+
+if TYPE_CHECKING:
+    from app.services.telegram_sender import Delivery
 
 logger = logging.getLogger(__name__)
 
+RECIPIENT_CHUNK_SIZE = 1000
+LEDGER_FLUSH_SIZE = 200
+MEDIA_KINDS = ("photo", "video")
+
+
+def _segment_filter(segment: BroadcastSegment, tag: Optional[str]) -> Optional[list[Any]]:
+    """WHERE clauses on User for a segment, or None if the segment matches nobody."""
+    if segment == BroadcastSegment.all:
+        return []
+    if segment == BroadcastSegment.subscribers:
+        return [
+            exists().where(
+                Subscription.user_id == User.id,
+                Subscription.status == SubscriptionStatus.active,
+                Subscription.end_date > datetime.now(timezone.utc),
+            )
+        ]
+    if segment == BroadcastSegment.tag and tag:
+        return [User.tags.contains([tag])]
+    return None
+
 
 async def get_recipients(
     db: AsyncSession,
     segment: BroadcastSegment,
     tag: Optional[str] = None,
 ) -> list[int]:
-    if segment == BroadcastSegment.all:
-        result = await db.execute(select(User.telegram_id))
-        return list(result.scalars().all())
-    if segment == BroadcastSegment.subscribers:
-        result = await db.execute(
-            select(User.telegram_id).join(Subscription).where(
-                Subscription.status == SubscriptionStatus.active,
-                Subscription.end_date > datetime.now(timezone.utc),
-            ).distinct()
+    clauses = _segment_filter(segment, tag)
+    if clauses is None:
+        return []
+    result = await db.execute(select(User.telegram_id).where(*clauses))
+    return list(result.scalars().all())
+
+
+async def iter_recipients(
+    db: AsyncSession,
+    segment: BroadcastSegment,
+    tag: Optional[str] = None,
+    chunk_size: int = RECIPIENT_CHUNK_SIZE,
+    skip_delivered_for: Optional[int] = None,
+    after_id: int = 0,
+    until_id: Optional[int] = None,
+) -> AsyncIterator[list[int]]:
+    """Yield telegram_ids of a segment in chunks, using keyset pagination over users.id.
+
+    `after_id` / `until_id` restrict the scan to the users.id range (after_id, until_id].
+    With `skip_delivered_for`, recipients already in that broadcast's ledger are left out.
+    """
+    clauses = _segment_filter(segment, tag)
+    if clauses is None:
+        return
+    if skip_delivered_for is not None:
+        clauses.append(
+            ~exists().where(
+                BroadcastDelivery.broadcast_id == skip_delivered_for,
+                BroadcastDelivery.telegram_id == User.telegram_id,
+            )
         )
-        return list(result.scalars().all())
-    if segment == BroadcastSegment.tag and tag:
+    if until_id is not None:
+        clauses.append(User.id <= until_id)
+    last_id = after_id
+    while True:
         result = await db.execute(
-            select(User.telegram_id).where(User.tags.contains([tag]))
+            select(User.id, User.telegram_id)
+            .where(User.id > last_id, *clauses)
+            .order_by(User.id)
+            .limit(chunk_size)
         )
-        return list(result.scalars().all())
-    return []
+        rows = result.all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [row.telegram_id for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+async def split_user_id_range(db: AsyncSession, shards: int) -> list[tuple[int, int]]:
+    """Split users.id into at most `shards` contiguous (after_id, until_id] ranges."""
+    lo, hi = (await db.execute(select(func.min(User.id), func.max(User.id)))).one()
+    if lo is None:
+        return []
+    span = hi - lo + 1
+    shards = max(1, min(shards, span))
+    step = -(-span // shards)
+    return [(start - 1, min(start + step - 1, hi)) for start in range(lo, hi + 1, step)]
+
+
+def _media_kind(content: dict) -> Optional[str]:
+    return next((kind for kind in MEDIA_KINDS if content.get(kind)), None)
+
+
+def needs_media_upload(content: dict) -> bool:
+    """True while the media is a URL Telegram would have to download for every recipient."""
+    kind = _media_kind(content)
+    return kind is not None and str(content[kind]).startswith(("http://", "https://"))
+
+
+def with_file_id(content: dict, sent_message: dict) -> dict:
+    """Copy of `content` whose media URL is replaced by the file_id from a sent message."""
+    kind = _media_kind(content)
+    media = sent_message.get(kind)
+    if isinstance(media, list):
+        media = media[-1]  # photo sizes, largest last
+    if not media or not media.get("file_id"):
+        return content
+    return {**content, kind: media["file_id"], f"{kind}_url": content[kind]}
+
+
+async def cached_media_content(content: dict) -> dict:
+    """Copy of `content` with the media URL replaced by a file_id cached from an earlier send."""
+    if not needs_media_upload(content):
+        return content
+    kind = _media_kind(content)
+    file_id = await get_file_id(await media_key(content[kind]))
+    if file_id is None:
+        return content
+    return {**content, kind: file_id, f"{kind}_url": content[kind]}
+
+
+async def remember_media_content(content: dict) -> None:
+    """Put the file_id of content returned by with_file_id() into the shared file_id cache."""
+    kind = _media_kind(content)
+    url = content.get(f"{kind}_url") if kind else None
+    if url:
+        await remember_file_id(await media_key(url), content[kind])
+
+
+async def send_content(chat_id: int, content: dict) -> ApiResult:
+    """Deliver broadcast content: copy of a source message, media by file_id/URL, or text.
+
+    content: {"source": {"chat_id": ..., "message_id": ...}} | {"photo"|"video": ..., "text": caption} | {"text": ...}
+    """
+    source = content.get("source")
+    if source:
+        return await copy_message(chat_id, source["chat_id"], source["message_id"])
+    text = content.get("text", "")
+    kind = _media_kind(content)
+    if kind:
+        return await send_media(chat_id, kind, content[kind], text or None)
+    return await send_message_result(chat_id, text)
+
+
+class ContentSender:
+    """send_content() that uploads URL media once and reuses the resulting file_id."""
+
+    def __init__(self, content: dict) -> None:
+        self.content = content
+        self._upload_lock = asyncio.Lock()
+        self._upload_tried = False
+
+    async def __call__(self, chat_id: int) -> ApiResult:
+        # Only the first upload is serialized; if it fails the rest send by URL in parallel.
+        if needs_media_upload(self.content) and not self._upload_tried:
+            async with self._upload_lock:
+                if not self._upload_tried:
+                    self._upload_tried = True
+                    self.content = await cached_media_content(self.content)
+                    if needs_media_upload(self.content):
+                        res = await send_content(chat_id, self.content)
+                        if res.ok:
+                            self.content = with_file_id(self.content, res.result or {})
+                            await remember_media_content(self.content)
+                        return res
+        return await send_content(chat_id, self.content)
+
+
+class DeliveryLedger:
+    """Buffers delivery outcomes and bulk-inserts them into broadcast_deliveries."""
+
+    def __init__(self, broadcast_id: int, flush_size: int = LEDGER_FLUSH_SIZE) -> None:
+        self.broadcast_id = broadcast_id
+        self.flush_size = flush_size
+        self._buffer: list[dict] = []
+        self._lock = asyncio.Lock()
+
+    async def record(self, delivery: "Delivery") -> None:
+        self._buffer.append({
+            "broadcast_id": self.broadcast_id,
+            "telegram_id": delivery.chat_id,
+            "status": DeliveryStatus.sent if delivery.ok else DeliveryStatus.failed,
+            "error_code": delivery.error_code,
+        })
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            async with async_session_maker() as db:
+                await db.execute(insert(BroadcastDelivery).values(rows).on_conflict_do_nothing())
+                await db.commit()
+
+
+async def build_stats(db: AsyncSession, broadcast_id: int) -> dict:
+    """Broadcast.stats computed from the ledger, with failures broken down by error code."""
+    result = await db.execute(
+        select(BroadcastDelivery.status, BroadcastDelivery.error_code, func.count())
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .group_by(BroadcastDelivery.status, BroadcastDelivery.error_code)
+    )
+    stats: dict[str, Any] = {"total": 0, "sent": 0, "failed": 0, "errors": {}}
+    for status, error_code, count in result.all():
+        stats["total"] += count
+        if status == DeliveryStatus.sent:
+            stats["sent"] += count
+        else:
+            stats["failed"] += count
+            key = str(error_code or "network")
+            stats["errors"][key] = stats["errors"].get(key, 0) + count
+    return stats
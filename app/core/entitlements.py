@@ -0,0 +1,100 @@
+"""
+Cached subscription entitlement: per user, the end of the latest active subscription.
+
+The value is an expiry timestamp (0 = none), so a cached entry turns false on its own when the
+subscription ends; it only has to be invalidated when subscriptions are created or cancelled.
+Lookup order: in-process cache -> Redis -> subscriptions table.
+"""
+import logging
+import time
+from datetime import timezone
+from typing import Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.core.cache import TTLCache
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+ENTITLEMENT_KEY = "entitlement:{user_id}"
+# Session.info key of user ids to invalidate again once the session commits.
+_PENDING_KEY = "pending_entitlement_invalidations"
+
+# Kept short: invalidations from other processes only reach this cache through expiry.
+_local: TTLCache[float] = TTLCache(settings.user_cache_size, settings.entitlement_local_ttl)
+
+
+async def _fetch_until(db: AsyncSession, user_id: int) -> float:
+    from app.core.subscription import get_active_subscription
+
+    sub = await get_active_subscription(db, user_id)
+    return sub.end_date.replace(tzinfo=timezone.utc).timestamp() if sub else 0.0
+
+
+async def get_entitlement_until(db: AsyncSession, user_id: int) -> float:
+    until = _local.get(user_id)
+    if until is not None:
+        return until
+    key = ENTITLEMENT_KEY.format(user_id=user_id)
+    cached: Optional[str] = None
+    try:
+        cached = await get_redis().get(key)
+    except Exception as e:
+        logger.warning("Entitlement cache read failed: %s", e)
+    if cached is not None:
+        until = float(cached)
+    else:
+        until = await _fetch_until(db, user_id)
+        await _store_remote(key, until)
+    _local.set(user_id, until)
+    return until
+
+
+async def has_entitlement(db: AsyncSession, user_id: int) -> bool:
+    return await get_entitlement_until(db, user_id) > time.time()
+
+
+def remember_entitlement(user_id: int, until: float) -> None:
+    """Seed the in-process cache with a value read elsewhere (e.g. a joined user query)."""
+    _local.set(user_id, until)
+
+
+async def _store_remote(key: str, until: float) -> None:
+    try:
+        await get_redis().set(key, until, ex=settings.entitlement_cache_ttl)
+    except Exception as e:
+        logger.warning("Entitlement cache write failed: %s", e)
+
+
+async def invalidate_entitlements(user_ids: Iterable[int]) -> None:
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        _local.pop(user_id)
+    try:
+        await get_redis().delete(*(ENTITLEMENT_KEY.format(user_id=u) for u in user_ids))
+    except Exception as e:
+        logger.warning("Entitlement cache invalidation failed: %s", e)
+
+
+async def invalidate_entitlement(user_id: int) -> None:
+    await invalidate_entitlements([user_id])
+
+
+async def invalidate_on_commit(db: AsyncSession, user_ids: Iterable[int]) -> None:
+    """Invalidate now and queue the ids for invalidate_committed().
+
+    Until the transaction commits a concurrent reader can re-cache the old value, so the
+    session owner must call invalidate_committed() after db.commit().
+    """
+    user_ids = set(user_ids)
+    db.info.setdefault(_PENDING_KEY, set()).update(user_ids)
+    await invalidate_entitlements(user_ids)
+
+
+async def invalidate_committed(db: AsyncSession) -> None:
+    await invalidate_entitlements(db.info.pop(_PENDING_KEY, ()))
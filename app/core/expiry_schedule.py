@@ -0,0 +1,55 @@
+"""
+Expiry timer: a Redis sorted set of subscription ids scored by end_date.
+
+The poller claims due ids every minute instead of waiting for the daily sweep. The timer is
+an optimisation only: the database stays the source of truth, and the daily sweep expires
+anything the timer missed (Redis unavailable, a claimed batch lost in a crash).
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Iterable
+
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_ZSET_KEY = "subscription_expiry:due"
+
+# Pop up to ARGV[2] members with score <= ARGV[1] atomically, so parallel pollers never
+# claim the same subscription twice.
+_CLAIM_DUE_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+def _score(end_date: datetime) -> float:
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=timezone.utc)
+    return end_date.timestamp()
+
+
+async def schedule_expiries(items: Iterable[tuple[int, datetime]]) -> None:
+    """Register (subscription_id, end_date) pairs; errors are logged, not raised."""
+    mapping = {str(sub_id): _score(end_date) for sub_id, end_date in items}
+    if not mapping:
+        return
+    try:
+        await get_redis().zadd(EXPIRY_ZSET_KEY, mapping)
+    except Exception as e:
+        logger.warning("Expiry timer registration failed for %s subscriptions: %s", len(mapping), e)
+
+
+async def schedule_expiry(subscription_id: int, end_date: datetime) -> None:
+    await schedule_expiries([(subscription_id, end_date)])
+
+
+async def claim_due(now: datetime, limit: int) -> list[int]:
+    """Remove and return up to `limit` subscription ids due at `now`."""
+    redis = get_redis()
+    claim = redis.register_script(_CLAIM_DUE_LUA)
+    ids = await claim(keys=[EXPIRY_ZSET_KEY], args=[_score(now), limit])
+    return [int(i) for i in ids]
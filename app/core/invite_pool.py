@@ -0,0 +1,94 @@
+"""
+Pool of pre-created single-use invite links to the private group.
+
+Links are created in the background (tasks/invite_pool.py) and kept in a Redis list as
+{"link", "created_at"} JSON, oldest at the tail. After a payment the invite is popped from
+the pool, so delivery is a single sendMessage. Links older than INVITE_LINK_MAX_AGE are
+moved to a revoke queue and revoked in bulk; they also carry an expire_date as a backstop.
+"""
+import json
+import logging
+import time
+from typing import Optional
+
+from app.config import get_settings
+from app.services.redis_client import get_redis
+from app.services.telegram_api import ApiResult, call_api
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INVITE_POOL_KEY = "invite_pool:links"
+INVITE_REVOKE_KEY = "invite_pool:revoke"
+
+# Pop entries older than ARGV[1] from the tail (oldest first) and return them.
+_POP_AGED_LUA = """
+local out = {}
+while true do
+    local raw = redis.call('LINDEX', KEYS[1], -1)
+    if not raw then break end
+    if tonumber(cjson.decode(raw)['created_at']) >= tonumber(ARGV[1]) then break end
+    redis.call('RPOP', KEYS[1])
+    out[#out + 1] = raw
+end
+return out
+"""
+
+
+def _usable_since() -> float:
+    # A popped link must stay valid long enough for the user to open it.
+    return time.time() - settings.invite_link_max_age + settings.invite_link_min_ttl
+
+
+async def create_pooled_link() -> ApiResult:
+    """Create a single-use link and append it to the pool."""
+    now = time.time()
+    res = await call_api("createChatInviteLink", {
+        "chat_id": settings.private_group_id,
+        "member_limit": 1,
+        "expire_date": int(now + settings.invite_link_max_age),
+    })
+    if res.ok and res.result and res.result.get("invite_link"):
+        entry = json.dumps({"link": res.result["invite_link"], "created_at": now})
+        await get_redis().lpush(INVITE_POOL_KEY, entry)
+    return res
+
+
+async def take_invite_link() -> Optional[str]:
+    """Oldest still-usable link from the pool, or None if the pool is empty or unavailable."""
+    redis = get_redis()
+    usable_since = _usable_since()
+    try:
+        while (raw := await redis.rpop(INVITE_POOL_KEY)) is not None:
+            entry = json.loads(raw)
+            if entry["created_at"] >= usable_since:
+                return entry["link"]
+            await redis.lpush(INVITE_REVOKE_KEY, entry["link"])
+    except Exception as e:
+        logger.warning("Invite link pool unavailable: %s", e)
+        return None
+    logger.warning("Invite link pool is empty")
+    return None
+
+
+async def pool_size() -> int:
+    return await get_redis().llen(INVITE_POOL_KEY)
+
+
+async def retire_aged_links() -> int:
+    """Move links too old to hand out from the pool to the revoke queue."""
+    redis = get_redis()
+    pop_aged = redis.register_script(_POP_AGED_LUA)
+    aged = await pop_aged(keys=[INVITE_POOL_KEY], args=[_usable_since()])
+    if aged:
+        await redis.lpush(INVITE_REVOKE_KEY, *(json.loads(raw)["link"] for raw in aged))
+    return len(aged)
+
+
+async def take_links_to_revoke(limit: int) -> list[str]:
+    return await get_redis().rpop(INVITE_REVOKE_KEY, limit) or []
+
+
+async def requeue_revoke(links: list[str]) -> None:
+    if links:
+        await get_redis().lpush(INVITE_REVOKE_KEY, *links)
@@ -0,0 +1,73 @@
+"""
+Transactional outbox: side effects are stored as rows in the same transaction as the data
+they depend on, and published to Celery by the relay (tasks/outbox_relay.py) after commit.
+
+Delivery is at least once: an event can be published again if the relay dies between
+publishing and committing, so consumers must tolerate duplicates. The relay passes the event
+id as `outbox_id`; consumers with visible side effects guard them with claim_outbox_event.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import Row, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import OutboxEvent
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_INVITE = "subscription_invite"
+
+OUTBOX_DONE_KEY = "outbox:done:{event_id}"
+# Far longer than any relay replay window.
+OUTBOX_DONE_TTL = 7 * 86400
+
+
+def add_outbox_event(db: AsyncSession, event_type: str, payload: dict) -> None:
+    """Queue an event; it becomes visible to the relay only when the caller commits."""
+    db.add(OutboxEvent(event_type=event_type, payload=payload))
+
+
+async def take_outbox_batch(db: AsyncSession, limit: int) -> list[Row]:
+    """Delete and return the oldest events; rows locked by another relay are skipped.
+
+    The deletion takes effect on commit, so the caller commits after publishing and rolls
+    back if publishing fails.
+    """
+    batch = (
+        select(OutboxEvent.id)
+        .order_by(OutboxEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        delete(OutboxEvent)
+        .where(OutboxEvent.id.in_(batch.scalar_subquery()))
+        .returning(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload)
+    )
+    return sorted(result.all(), key=lambda row: row.id)
+
+
+async def claim_outbox_event(event_id: Optional[int]) -> bool:
+    """SET NX on the event id; False if another delivery of the event already handled it.
+
+    If Redis is unavailable the event is handled anyway: a duplicate beats a lost side effect.
+    """
+    if event_id is None:
+        return True
+    try:
+        return bool(await get_redis().set(OUTBOX_DONE_KEY.format(event_id=event_id), "1", nx=True, ex=OUTBOX_DONE_TTL))
+    except Exception as e:
+        logger.warning("Outbox event id=%s claim failed, handling anyway: %s", event_id, e)
+        return True
+
+
+async def release_outbox_event(event_id: Optional[int]) -> None:
+    """Undo claim_outbox_event when handling failed, so a retry can run."""
+    if event_id is None:
+        return
+    try:
+        await get_redis().delete(OUTBOX_DONE_KEY.format(event_id=event_id))
+    except Exception as e:
+        logger.warning("Outbox event id=%s release failed: %s", event_id, e)
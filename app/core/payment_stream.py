@@ -0,0 +1,124 @@
+"""
+Payment webhook ingestion stream (PAYMENT_WEBHOOK_MODE=stream).
+
+The webhook only verifies the signature and XADDs the raw body to a Redis stream; consumers
+(tasks/payment_stream.py) read it through a consumer group in batches. Entries are acked and
+deleted after their batch commits; entries of a crashed consumer, or left pending because
+processing failed, are reclaimed after PAYMENT_STREAM_CLAIM_IDLE seconds. Durability follows the Redis persistence settings (AOF).
+"""
+import logging
+import time
+from typing import Any
+
+from redis.exceptions import ResponseError
+
+from app.config import get_settings
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PAYMENT_STREAM_KEY = "payments:stream"
+PAYMENT_STREAM_GROUP = "payments"
+# Events that failed on their own, kept for inspection.
+PAYMENT_DEAD_KEY = "payments:stream:dead"
+PAYMENT_STREAM_METRICS_KEY = "payments:stream:metrics"
+
+StreamEntry = tuple[str, dict[str, Any]]
+
+
+async def append_payment_event(provider: str, body: bytes) -> str:
+    return await get_redis().xadd(PAYMENT_STREAM_KEY, {
+        "provider": provider,
+        "body": body.decode("utf-8"),
+        "received_at": time.time(),
+    })
+
+
+async def ensure_group() -> None:
+    try:
+        await get_redis().xgroup_create(PAYMENT_STREAM_KEY, PAYMENT_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def read_batch(consumer: str, count: int) -> list[StreamEntry]:
+    """Entries abandoned by dead consumers first, then new ones."""
+    redis = get_redis()
+    entries: list[StreamEntry] = []
+    # Walk the whole pending list: idle entries may sit behind ones that are still in flight.
+    cursor = "0-0"
+    while len(entries) < count:
+        cursor, claimed, *_ = await redis.xautoclaim(
+            PAYMENT_STREAM_KEY, PAYMENT_STREAM_GROUP, consumer,
+            min_idle_time=int(settings.payment_stream_claim_idle * 1000),
+            start_id=cursor, count=count - len(entries),
+        )
+        entries.extend(e for e in claimed if e[1])
+        if cursor == "0-0":
+            break
+    if len(entries) < count:
+        fresh = await redis.xreadgroup(
+            PAYMENT_STREAM_GROUP, consumer, {PAYMENT_STREAM_KEY: ">"}, count=count - len(entries),
+        )
+        for _, stream_entries in fresh:
+            entries.extend(stream_entries)
+    return entries
+
+
+async def ack(entry_ids: list[str]) -> None:
+    if not entry_ids:
+        return
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.xack(PAYMENT_STREAM_KEY, PAYMENT_STREAM_GROUP, *entry_ids)
+        pipe.xdel(PAYMENT_STREAM_KEY, *entry_ids)
+        await pipe.execute()
+
+
+async def delivery_counts(entry_ids: list[str]) -> dict[str, int]:
+    """How many times each pending entry has been delivered to a consumer."""
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for entry_id in entry_ids:
+            pipe.xpending_range(PAYMENT_STREAM_KEY, PAYMENT_STREAM_GROUP, min=entry_id, max=entry_id, count=1)
+        results = await pipe.execute()
+    return {p["message_id"]: p["times_delivered"] for pending in results for p in pending}
+
+
+async def dead_letter(entry: StreamEntry, error: str) -> None:
+    entry_id, fields = entry
+    await get_redis().xadd(PAYMENT_DEAD_KEY, {**fields, "entry_id": entry_id, "error": error[:500]})
+    await ack([entry_id])
+
+
+async def record_batch(entries: list[StreamEntry]) -> None:
+    now = time.time()
+    lags = [now - float(fields.get("received_at", now)) for _, fields in entries]
+    try:
+        await get_redis().hset(PAYMENT_STREAM_METRICS_KEY, mapping={
+            "last_run_at": now,
+            "last_batch": len(entries),
+            "last_max_lag": round(max(lags), 3),
+        })
+    except Exception as e:
+        logger.warning("Payment stream metrics write failed: %s", e)
+
+
+async def stream_stats() -> dict:
+    redis = get_redis()
+    await ensure_group()
+    length = await redis.xlen(PAYMENT_STREAM_KEY)
+    pending = await redis.xpending(PAYMENT_STREAM_KEY, PAYMENT_STREAM_GROUP)
+    groups = await redis.xinfo_groups(PAYMENT_STREAM_KEY)
+    group = next((g for g in groups if g.get("name") == PAYMENT_STREAM_GROUP), {})
+    # Stream ids start with the append time in ms: the oldest entry tells how far behind we are.
+    oldest = await redis.xrange(PAYMENT_STREAM_KEY, count=1)
+    oldest_age = round(time.time() - int(oldest[0][0].split("-")[0]) / 1000, 3) if oldest else 0.0
+    return {
+        "length": length,
+        "pending": pending.get("pending", 0),
+        "lag": group.get("lag"),
+        "oldest_age_seconds": oldest_age,
+        "dead": await redis.xlen(PAYMENT_DEAD_KEY),
+        **await redis.hgetall(PAYMENT_STREAM_METRICS_KEY),
+    }
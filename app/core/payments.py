@@ -2,21 +2,24 @@ import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Optional
+from typing import Any, Optional, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from redis import asyncio as aioredis
 
 from app.config import get_settings
 from app.db.models import User, Payment, Subscription
 from app.db.models.payment import PaymentStatus
 from app.db.models.subscription import PlanType, SubscriptionStatus
+from app.core.outbox import SUBSCRIPTION_INVITE, add_outbox_event
+from app.services.redis_client import get_redis
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 IDEMPOTENCY_TTL = 86400  # 24 hours
+SUCCESS_STATUSES = ("succeeded", "completed", "paid", "success")
 
 
 @dataclass
@@ -29,71 +32,167 @@ class PaymentWebhookPayload:
     user_telegram_id: Optional[int] = None
 
 
-async def get_redis() -> aioredis.Redis:
-    return aioredis.from_url(settings.redis_url, decode_responses=True)
+def _telegram_id(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        # Logged as an unknown payer further down, like a missing id.
+        logger.warning("Payment webhook: invalid telegram_id %r", value)
+        return None
+
+
+def payload_from_webhook(data: dict[str, Any], provider: str) -> PaymentWebhookPayload:
+    telegram_id = data.get("user_telegram_id") or (data.get("metadata") or {}).get("telegram_id")
+    return PaymentWebhookPayload(
+        provider=provider,
+        external_id=data.get("id") or data.get("payment_id") or str(data.get("external_id", "")),
+        status=data.get("status", "").lower(),
+        amount=data.get("amount"),
+        currency=data.get("currency", "RUB"),
+        user_telegram_id=_telegram_id(telegram_id),
+    )
+
+
+def _payment_row(user_id: int, payload: PaymentWebhookPayload) -> dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "provider": payload.provider,
+        "external_id": payload.external_id,
+        "amount": payload.amount or Decimal("0"),
+        "currency": payload.currency,
+        "status": PaymentStatus.completed,
+    }
+
+
+async def _claim_payments(db: AsyncSession, rows: list[dict[str, Any]]) -> dict[str, int]:
+    """Record completed payments; returns external_id -> user_id of those completed by this call.
+
+    A single INSERT ... ON CONFLICT (external_id) DO UPDATE ... WHERE status <> completed both
+    claims and records an event: a new id is inserted, a pending/failed payment is completed,
+    an already completed one returns nothing. A concurrent duplicate waits on the row lock and
+    then sees it completed. rows must have distinct external_ids.
+    """
+    stmt = insert(Payment).values(rows)
+    result = await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Payment.external_id],
+            set_={"status": PaymentStatus.completed},
+            where=Payment.status != PaymentStatus.completed,
+        ).returning(Payment.external_id, Payment.user_id)
+    )
+    return dict(result.all())
+
+
+async def _complete_existing(db: AsyncSession, external_ids: Sequence[str]) -> dict[str, int]:
+    """Complete payments recorded earlier (pending/failed) when the event names no known user."""
+    result = await db.execute(
+        update(Payment)
+        .where(Payment.external_id.in_(external_ids), Payment.status != PaymentStatus.completed)
+        .values(status=PaymentStatus.completed)
+        .returning(Payment.external_id, Payment.user_id)
+    )
+    return dict(result.all())
+
+
+def _processed_key(provider: str, external_id: str) -> str:
+    return f"payment:processed:{provider}:{external_id}"
+
+
+async def is_payment_processed(provider: str, external_id: str) -> bool:
+    """Optional front-cache over the payments table; it is written only after a commit."""
+    try:
+        return bool(await get_redis().exists(_processed_key(provider, external_id)))
+    except Exception as e:
+        logger.warning("Payment idempotency cache read failed: %s", e)
+        return False
 
 
-async def idempotency_check(provider: str, external_id: str) -> bool:
-    redis = await get_redis()
-    key = f"payment:idempotency:{provider}:{external_id}"
+async def mark_payment_processed(provider: str, external_id: str) -> None:
     try:
-        added = await redis.set(key, "1", nx=True, ex=IDEMPOTENCY_TTL)
-        return not added
-    finally:
-        await redis.aclose()
+        await get_redis().set(_processed_key(provider, external_id), "1", ex=IDEMPOTENCY_TTL)
+    except Exception as e:
+        logger.warning("Payment idempotency cache write failed: %s", e)
 
 
 async def process_payment_webhook(db: AsyncSession, payload: PaymentWebhookPayload) -> Optional[int]:
-    if payload.status not in ("succeeded", "completed", "paid", "success"):
-        redis = await get_redis()
-        try:
-            await redis.set(
-                f"payment:idempotency:{payload.provider}:{payload.external_id}",
-                "1", ex=IDEMPOTENCY_TTL,
-            )
-        finally:
-            await redis.aclose()
+    """Record a payment event and activate the subscription.
+
+    Returns the payer's telegram_id if this call completed the payment, None for non-success
+    statuses, duplicates and unknown payers. The caller commits, then calls invalidate_committed().
+    """
+    if payload.status not in SUCCESS_STATUSES:
         logger.info("Payment %s status %s - not success, skipping subscription", payload.external_id, payload.status)
         return None
 
-    result = await db.execute(select(Payment).where(Payment.external_id == payload.external_id))
-    existing = result.scalar_one_or_none()
-    if existing:
-        if existing.status == PaymentStatus.completed:
-            logger.info("Payment %s already completed, skip", payload.external_id)
-            return None
-        existing.status = PaymentStatus.completed
-        await db.flush()
-        user_id = existing.user_id
-        result = await db.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one()
-        await activate_subscription_for_payment(db, user.id, payload)
-        logger.info("Payment %s processed (existing), subscription activated", payload.external_id)
-        return user.telegram_id
+    user_id = None
+    if payload.user_telegram_id:
+        result = await db.execute(select(User.id).where(User.telegram_id == payload.user_telegram_id))
+        user_id = result.scalar_one_or_none()
+    if user_id is not None:
+        claimed = await _claim_payments(db, [_payment_row(user_id, payload)])
     else:
-        if not payload.user_telegram_id:
-            logger.error("Payment %s: no user_telegram_id", payload.external_id)
-            return None
-        result = await db.execute(select(User).where(User.telegram_id == payload.user_telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            logger.error("Payment %s: user telegram_id=%s not found", payload.external_id, payload.user_telegram_id)
-            return None
-        payment = Payment(
-            user_id=user.id,
-            provider=payload.provider,
-            external_id=payload.external_id,
-            amount=payload.amount or Decimal("0"),
-            currency=payload.currency,
-            status=PaymentStatus.completed,
-        )
-        db.add(payment)
-        await db.flush()
-        await activate_subscription_for_payment(db, user.id, payload)
-        logger.info("Payment %s processed, subscription activated", payload.external_id)
-        return user.telegram_id
-
-    return None
+        claimed = await _complete_existing(db, [payload.external_id])
+    if not claimed:
+        if user_id is None:
+            logger.error(
+                "Payment %s: user telegram_id=%s not found and no pending payment",
+                payload.external_id, payload.user_telegram_id,
+            )
+        else:
+            logger.info("Payment %s already completed, skip", payload.external_id)
+        return None
+
+    payer_id = claimed[payload.external_id]
+    telegram_id = payload.user_telegram_id
+    if payer_id != user_id:
+        # Completed an earlier payment row: the payer is the user recorded on it.
+        result = await db.execute(select(User.telegram_id).where(User.id == payer_id))
+        telegram_id = result.scalar_one()
+    await activate_subscription_for_payment(db, payer_id, payload)
+    add_outbox_event(db, SUBSCRIPTION_INVITE, {"telegram_id": telegram_id})
+    logger.info("Payment %s processed, subscription activated", payload.external_id)
+    return telegram_id
+
+
+async def process_payment_batch(db: AsyncSession, payloads: Sequence[PaymentWebhookPayload]) -> int:
+    """Set-based process_payment_webhook for a batch of events; returns payments activated.
+
+    All events are claimed with one INSERT ... ON CONFLICT DO UPDATE (see _claim_payments),
+    and their subscriptions are created in bulk. The caller commits, then calls
+    invalidate_committed().
+    """
+    from app.core.subscription import create_subscriptions_bulk
+
+    succeeded: dict[str, PaymentWebhookPayload] = {}
+    for p in payloads:
+        if p.external_id and p.status in SUCCESS_STATUSES:
+            succeeded.setdefault(p.external_id, p)
+    if not succeeded:
+        return 0
+    telegram_ids = {p.user_telegram_id for p in succeeded.values() if p.user_telegram_id}
+    users: dict[int, int] = {}
+    if telegram_ids:
+        result = await db.execute(select(User.telegram_id, User.id).where(User.telegram_id.in_(telegram_ids)))
+        users = dict(result.all())
+    rows = [_payment_row(users[p.user_telegram_id], p) for p in succeeded.values() if p.user_telegram_id in users]
+    unknown = [ext for ext, p in succeeded.items() if p.user_telegram_id not in users]
+    activated = await _claim_payments(db, rows) if rows else {}
+    if unknown:
+        completed = await _complete_existing(db, unknown)
+        for ext in unknown:
+            if ext not in completed:
+                logger.error("Payment %s: user telegram_id=%s not found and no pending payment", ext, succeeded[ext].user_telegram_id)
+        activated.update(completed)
+    if not activated:
+        return 0
+    await create_subscriptions_bulk(
+        db, [(user_id, infer_plan_from_amount(succeeded[ext].amount)) for ext, user_id in activated.items()],
+    )
+    result = await db.execute(select(User.id, User.telegram_id).where(User.id.in_(set(activated.values()))))
+    for _, telegram_id in result.all():
+        add_outbox_event(db, SUBSCRIPTION_INVITE, {"telegram_id": telegram_id})
+    logger.info("Payment batch: %s of %s events activated subscriptions", len(activated), len(payloads))
+    return len(activated)
 
 
 def plan_duration(plan_type: str) -> timedelta:
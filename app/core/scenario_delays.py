@@ -0,0 +1,107 @@
+"""
+Delayed scenario steps: a Redis sorted set of (user, scenario) scored by due time.
+
+At most one pending step per user and scenario: scheduling again replaces it, and leaving the
+scenario (another path, restart, /stop_scenario) removes it with a single ZREM. A poller claims
+due entries in batches (see tasks/scenario_delayed.py) and records how late they were sent.
+"""
+import logging
+import time
+from dataclasses import dataclass
+
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# member "user_id:scenario_id", score = due unix time
+DELAY_ZSET_KEY = "scenario_delay:due"
+# member -> "telegram_id:step_id"
+DELAY_PAYLOAD_KEY = "scenario_delay:payload"
+DELAY_METRICS_KEY = "scenario_delay:metrics"
+
+# Pop up to ARGV[2] entries due at ARGV[1] with their payloads; returns [member, score, payload, ...].
+_CLAIM_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+local out = {}
+for i = 1, #due, 2 do
+    local payload = redis.call('HGET', KEYS[2], due[i]) or ''
+    out[#out + 1] = due[i]
+    out[#out + 1] = due[i + 1]
+    out[#out + 1] = payload
+    redis.call('ZREM', KEYS[1], due[i])
+    redis.call('HDEL', KEYS[2], due[i])
+end
+return out
+"""
+
+
+@dataclass(slots=True)
+class DueStep:
+    user_id: int
+    scenario_id: int
+    telegram_id: int
+    step_id: str
+    due_at: float
+
+
+def _member(user_id: int, scenario_id: int) -> str:
+    return f"{user_id}:{scenario_id}"
+
+
+async def schedule_step(user_id: int, scenario_id: int, telegram_id: int, step_id: str, due_at: float) -> None:
+    member = _member(user_id, scenario_id)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.zadd(DELAY_ZSET_KEY, {member: due_at})
+        pipe.hset(DELAY_PAYLOAD_KEY, member, f"{telegram_id}:{step_id}")
+        await pipe.execute()
+
+
+async def cancel_delayed_step(user_id: int, scenario_id: int) -> None:
+    member = _member(user_id, scenario_id)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.zrem(DELAY_ZSET_KEY, member)
+        pipe.hdel(DELAY_PAYLOAD_KEY, member)
+        await pipe.execute()
+
+
+async def claim_due_steps(now: float, limit: int) -> list[DueStep]:
+    redis = get_redis()
+    claim = redis.register_script(_CLAIM_DUE_LUA)
+    raw = await claim(keys=[DELAY_ZSET_KEY, DELAY_PAYLOAD_KEY], args=[now, limit])
+    due: list[DueStep] = []
+    for member, score, payload in zip(raw[0::3], raw[1::3], raw[2::3]):
+        if not payload:
+            continue
+        user_id, scenario_id = member.split(":", 1)
+        telegram_id, step_id = payload.split(":", 1)
+        due.append(DueStep(int(user_id), int(scenario_id), int(telegram_id), step_id, float(score)))
+    return due
+
+
+async def record_dispatch(now: float, due: list[DueStep]) -> None:
+    """Store lag figures of the last poll for /metrics."""
+    if not due:
+        return
+    lags = [now - d.due_at for d in due]
+    try:
+        await get_redis().hset(DELAY_METRICS_KEY, mapping={
+            "last_run_at": now,
+            "last_batch": len(due),
+            "last_max_lag": round(max(lags), 3),
+            "last_avg_lag": round(sum(lags) / len(lags), 3),
+        })
+    except Exception as e:
+        logger.warning("Delayed step metrics write failed: %s", e)
+
+
+async def delay_stats() -> dict:
+    redis = get_redis()
+    now = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zcard(DELAY_ZSET_KEY)
+        pipe.zcount(DELAY_ZSET_KEY, "-inf", now)
+        pipe.zrange(DELAY_ZSET_KEY, 0, 0, withscores=True)
+        pipe.hgetall(DELAY_METRICS_KEY)
+        pending, overdue, oldest, last = await pipe.execute()
+    oldest_lag = round(now - oldest[0][1], 3) if oldest and oldest[0][1] <= now else 0.0
+    return {"pending": pending, "overdue": overdue, "oldest_overdue_seconds": oldest_lag, **last}
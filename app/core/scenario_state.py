@@ -0,0 +1,118 @@
+"""
+Hot scenario progress: current step per (user, scenario) in Redis, written behind to Postgres.
+
+A click costs an HGET and an HSET+SADD; `flush_dirty_progress` (Celery beat) copies changed
+entries to user_scenario_progress with one upsert per batch. Redis misses fall back to the
+table, and if Redis is unavailable progress is written straight to the table.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.db.models import Scenario, User, UserScenarioProgress
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Hash per user: scenario_id -> current step id.
+SCENARIO_STATE_KEY = "scenario_state:{user_id}"
+# "user_id:scenario_id" entries changed since the last flush.
+SCENARIO_DIRTY_KEY = "scenario_state:dirty"
+
+
+def _state_key(user_id: int) -> str:
+    return SCENARIO_STATE_KEY.format(user_id=user_id)
+
+
+async def _upsert(db: AsyncSession, rows: list[dict]) -> None:
+    stmt = insert(UserScenarioProgress).values(rows)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[UserScenarioProgress.user_id, UserScenarioProgress.scenario_id],
+            set_={"current_step_id": stmt.excluded.current_step_id, "updated_at": func.now()},
+        )
+    )
+
+
+async def get_current_step(db: AsyncSession, user_id: int, scenario_id: int) -> Optional[str]:
+    key = _state_key(user_id)
+    try:
+        step_id = await get_redis().hget(key, str(scenario_id))
+        if step_id is not None:
+            return step_id
+    except Exception as e:
+        logger.warning("Scenario state read failed: %s", e)
+    result = await db.execute(
+        select(UserScenarioProgress.current_step_id).where(
+            UserScenarioProgress.user_id == user_id,
+            UserScenarioProgress.scenario_id == scenario_id,
+        )
+    )
+    step_id = result.scalar_one_or_none()
+    if step_id is not None:
+        try:
+            redis = get_redis()
+            await redis.hset(key, str(scenario_id), step_id)
+            await redis.expire(key, settings.scenario_state_ttl)
+        except Exception as e:
+            logger.warning("Scenario state cache fill failed: %s", e)
+    return step_id
+
+
+async def set_current_step(db: AsyncSession, user_id: int, scenario_id: int, step_id: str) -> None:
+    key = _state_key(user_id)
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(key, str(scenario_id), step_id)
+            pipe.expire(key, settings.scenario_state_ttl)
+            pipe.sadd(SCENARIO_DIRTY_KEY, f"{user_id}:{scenario_id}")
+            await pipe.execute()
+        return
+    except Exception as e:
+        logger.warning("Scenario state write failed, writing through: %s", e)
+    await _upsert(db, [{"user_id": user_id, "scenario_id": scenario_id, "current_step_id": step_id}])
+    await db.commit()
+
+
+async def flush_dirty_progress(db: AsyncSession, batch_size: int) -> int:
+    """Write one batch of changed progress entries to the table; returns the batch size.
+
+    Entries are re-marked dirty if the write fails. A step changed after it was read here is
+    marked dirty again by set_current_step and goes out with the next batch.
+    """
+    redis = get_redis()
+    members = await redis.spop(SCENARIO_DIRTY_KEY, batch_size)
+    if not members:
+        return 0
+    pairs = [tuple(int(x) for x in m.split(":", 1)) for m in members]
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id, scenario_id in pairs:
+            pipe.hget(_state_key(user_id), str(scenario_id))
+        steps = await pipe.execute()
+    rows = [
+        {"user_id": u, "scenario_id": s, "current_step_id": step}
+        for (u, s), step in zip(pairs, steps)
+        if step is not None
+    ]
+    if not rows:
+        return len(members)
+    try:
+        # Users or scenarios deleted meanwhile would fail the whole batch on the foreign keys.
+        users = set((await db.execute(select(User.id).where(User.id.in_({r["user_id"] for r in rows})))).scalars())
+        scenarios = set((await db.execute(
+            select(Scenario.id).where(Scenario.id.in_({r["scenario_id"] for r in rows}))
+        )).scalars())
+        rows = [r for r in rows if r["user_id"] in users and r["scenario_id"] in scenarios]
+        if rows:
+            await _upsert(db, rows)
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        await redis.sadd(SCENARIO_DIRTY_KEY, *members)
+        raise
+    return len(members)
@@ -1,15 +1,103 @@
 """
 Scenario engine: executes JSON scenario steps (text, media, buttons, delayed steps, subscription check).
+
+Scenarios are compiled once per (id, updated_at) into an immutable graph with O(1) transitions
+and pre-built keyboards; the compiled graph is cached in process and rebuilt when the row changes.
+Transition buttons carry `sc:<scenario_id>:<on_callback>` and are routed by handlers/scenarios.py;
+the user's current step is kept in scenario_state.
 """
 import logging
-from typing import Any, Optional
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Union
 
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.core.cache import TTLCache
+from app.core.scenario_delays import cancel_delayed_step, schedule_step
+from app.core.scenario_state import get_current_step, set_current_step
+from app.db.models import Scenario
+from app.services.file_ids import send_cached_media
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# user_scenario_progress.current_step_id is String(64); Telegram limits callback_data to 64 bytes.
+MAX_STEP_ID_LENGTH = 64
+MAX_CALLBACK_DATA_BYTES = 64
+SCENARIO_CALLBACK_PREFIX = "sc:"
+# "delay": {"days": 1, "hours": 2} or a number of seconds
+DELAY_UNITS = ("days", "hours", "minutes", "seconds")
+# step type -> (JSON field with the media, Telegram media kind)
+STEP_MEDIA = {
+    "image": ("photo", "photo"),
+    "video": ("video", "video"),
+    "audio": ("audio", "audio"),
+    "file": ("file", "document"),
+}
+
+
+class ScenarioValidationError(ValueError):
+    """The scenario JSON cannot be compiled (duplicate ids, dangling next_step_id, ...)."""
+
+
+@dataclass(slots=True, frozen=True)
+class CompiledStep:
+    id: str
+    data: Mapping[str, Any]
+    keyboard: Optional[InlineKeyboardMarkup]
+    transitions: Mapping[str, str]  # on_callback -> step id
+    next_step_id: Optional[str]
+    delay: float = 0.0  # seconds to wait before sending, counted from the previous step
+
+
+@dataclass(slots=True, frozen=True)
+class CompiledScenario:
+    id: int
+    updated_at: Optional[datetime]
+    name: str
+    subscription_required: bool
+    steps: Mapping[str, CompiledStep]
+    first: Optional[CompiledStep]
+
+    def step(self, step_id: str) -> Optional[CompiledStep]:
+        return self.steps.get(step_id)
+
+    def next_step(self, step_id: str, callback: Optional[str] = None) -> Optional[CompiledStep]:
+        current = self.steps.get(step_id)
+        if current is None:
+            return None
+        if callback is not None and callback in current.transitions:
+            return self.steps[current.transitions[callback]]
+        return self.steps.get(current.next_step_id) if current.next_step_id else None
+
+    def transition(self, step_id: str, callback: str) -> Optional[CompiledStep]:
+        """Target of a button press on `step_id`; None if the button does not belong to it."""
+        current = self.steps.get(step_id)
+        if current is None or callback not in current.transitions:
+            return None
+        return self.steps[current.transitions[callback]]
+
+
+def scenario_callback_data(scenario_id: int, callback: str) -> str:
+    return f"{SCENARIO_CALLBACK_PREFIX}{scenario_id}:{callback}"
+
+
+def parse_scenario_callback(data: str) -> Optional[tuple[int, str]]:
+    if not data.startswith(SCENARIO_CALLBACK_PREFIX):
+        return None
+    scenario_id, _, callback = data[len(SCENARIO_CALLBACK_PREFIX):].partition(":")
+    if not scenario_id.isdigit() or not callback:
+        return None
+    return int(scenario_id), callback
 
 
 def build_keyboard(buttons: list[dict]) -> Optional[InlineKeyboardMarkup]:
@@ -27,40 +115,153 @@ def build_keyboard(buttons: list[dict]) -> Optional[InlineKeyboardMarkup]:
     return builder.as_markup()
 
 
-async def send_step(bot: Bot, chat_id: int, step: dict) -> bool:
+def _parse_delay(step_id: str, value: Any) -> float:
+    if value is None:
+        return 0.0
+    if isinstance(value, dict) and value and set(value) <= set(DELAY_UNITS):
+        try:
+            seconds = timedelta(**{unit: float(v) for unit, v in value.items()}).total_seconds()
+        except (TypeError, ValueError):
+            seconds = -1.0
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        seconds = -1.0
+    if seconds < 0:
+        raise ScenarioValidationError(f"Шаг {step_id}: некорректная задержка {value!r}")
+    return seconds
+
+
+def _compile_step(raw: dict, position: int, scenario_id: int) -> CompiledStep:
+    step_id = raw.get("id")
+    if not step_id or not isinstance(step_id, str):
+        raise ScenarioValidationError(f"Шаг #{position}: нет id")
+    if len(step_id) > MAX_STEP_ID_LENGTH:
+        raise ScenarioValidationError(f"Шаг {step_id}: id длиннее {MAX_STEP_ID_LENGTH} символов")
+    transitions: dict[str, str] = {}
+    for t in raw.get("transitions") or []:
+        callback, target = t.get("on_callback"), t.get("next_step_id")
+        if not callback or not target:
+            raise ScenarioValidationError(f"Шаг {step_id}: переход без on_callback или next_step_id")
+        if callback in transitions:
+            raise ScenarioValidationError(f"Шаг {step_id}: повторный переход для «{callback}»")
+        transitions[callback] = target
+    buttons = []
+    for btn in raw.get("buttons") or []:
+        data = btn.get("callback_data")
+        if not data and not btn.get("url"):
+            raise ScenarioValidationError(f"Шаг {step_id}: у кнопки «{btn.get('text', '')}» нет callback_data и url")
+        # Buttons wired to a transition are routed to the scenario runtime; others stay as given.
+        if data in transitions:
+            data = scenario_callback_data(scenario_id, data)
+            btn = {**btn, "callback_data": data}
+        if data and len(data.encode()) > MAX_CALLBACK_DATA_BYTES:
+            raise ScenarioValidationError(f"Шаг {step_id}: callback_data «{data}» длиннее {MAX_CALLBACK_DATA_BYTES} байт")
+        buttons.append(btn)
+    return CompiledStep(
+        id=step_id,
+        data=MappingProxyType(dict(raw)),
+        keyboard=build_keyboard(buttons),
+        transitions=MappingProxyType(transitions),
+        next_step_id=raw.get("next_step_id") or None,
+        delay=_parse_delay(step_id, raw.get("delay")),
+    )
+
+
+def compile_scenario(
+    scenario_id: int,
+    structure: dict,
+    *,
+    name: str = "",
+    subscription_required: bool = False,
+    updated_at: Optional[datetime] = None,
+) -> CompiledScenario:
+    """Build and validate the step graph; raises ScenarioValidationError."""
+    steps: dict[str, CompiledStep] = {}
+    for position, raw in enumerate(structure.get("steps") or [], start=1):
+        step = _compile_step(raw, position, scenario_id)
+        if step.id in steps:
+            raise ScenarioValidationError(f"Повторный id шага: {step.id}")
+        steps[step.id] = step
+    for step in steps.values():
+        targets = [*step.transitions.values(), *([step.next_step_id] if step.next_step_id else [])]
+        for target in targets:
+            if target not in steps:
+                raise ScenarioValidationError(f"Шаг {step.id}: переход на несуществующий шаг {target}")
+    return CompiledScenario(
+        id=scenario_id,
+        updated_at=updated_at,
+        name=name,
+        subscription_required=subscription_required,
+        steps=MappingProxyType(steps),
+        first=next(iter(steps.values()), None),
+    )
+
+
+# Entries are checked against updated_at on every lookup; the TTL bounds how long a write that
+# does not bump updated_at (raw SQL, manual fixes) keeps serving the old steps.
+_compiled: TTLCache[CompiledScenario] = TTLCache(settings.scenario_cache_size, settings.scenario_cache_ttl)
+
+
+async def get_compiled_scenario(
+    db: AsyncSession,
+    scenario_id: int,
+    active_only: bool = True,
+) -> Optional[CompiledScenario]:
+    """Compiled scenario, or None if it does not exist (or is inactive).
+
+    A cache hit costs one narrow row lookup; the JSON is loaded and compiled only when the
+    scenario changed. Invalid scenarios raise ScenarioValidationError.
+    """
+    query = select(Scenario.updated_at).where(Scenario.id == scenario_id)
+    if active_only:
+        query = query.where(Scenario.is_active == True)
+    updated_at = (await db.execute(query)).one_or_none()
+    if updated_at is None:
+        # Deleted or deactivated: drop the stale graph.
+        _compiled.pop(scenario_id)
+        return None
+    updated_at = updated_at[0]
+    compiled = _compiled.get(scenario_id)
+    if compiled is not None and compiled.updated_at == updated_at:
+        return compiled
+    scenario = await db.get(Scenario, scenario_id)
+    if scenario is None:
+        _compiled.pop(scenario_id)
+        return None
+    compiled = compile_scenario(
+        scenario.id,
+        scenario.json_structure or {},
+        name=scenario.name,
+        subscription_required=scenario.subscription_required,
+        updated_at=scenario.updated_at,
+    )
+    _compiled.set(scenario_id, compiled)
+    logger.info("Compiled scenario id=%s (%s steps)", scenario_id, len(compiled.steps))
+    return compiled
+
+
+async def send_step(bot: Bot, chat_id: int, step: Union[CompiledStep, Mapping[str, Any]]) -> bool:
+    if isinstance(step, CompiledStep):
+        keyboard = step.keyboard
+        step = step.data
+    else:
+        keyboard = build_keyboard(step.get("buttons", []))
     step_type = step.get("type", "text")
     text = step.get("text", "")
-    keyboard = build_keyboard(step.get("buttons", []))
 
     parse_mode = ParseMode.HTML
-    if step_type == "image" and step.get("photo"):
-        await bot.send_photo(
-            chat_id, step["photo"],
-            caption=text or None,
-            reply_markup=keyboard,
-            parse_mode=parse_mode,
-        )
-    elif step_type == "video" and step.get("video"):
-        await bot.send_video(
-            chat_id, step["video"],
-            caption=text or None,
-            reply_markup=keyboard,
-            parse_mode=parse_mode,
-        )
-    elif step_type == "audio" and step.get("audio"):
-        await bot.send_audio(
-            chat_id, step["audio"],
+    media = STEP_MEDIA.get(step_type)
+    if media and step.get(media[0]):
+        field, kind = media
+        send_method = getattr(bot, f"send_{kind}")
+        # URLs are downloaded by Telegram once; later sends reuse the cached file_id.
+        await send_cached_media(step[field], kind, lambda m: send_method(
+            chat_id, m,
             caption=text or None,
             reply_markup=keyboard,
             parse_mode=parse_mode,
-        )
-    elif step_type == "file" and step.get("file"):
-        await bot.send_document(
-            chat_id, step["file"],
-            caption=text or None,
-            reply_markup=keyboard,
-            parse_mode=parse_mode,
-        )
+        ))
     else:
         await bot.send_message(
             chat_id,
@@ -71,23 +272,90 @@ async def send_step(bot: Bot, chat_id: int, step: dict) -> bool:
     return True
 
 
-def get_next_step(steps: list[dict], step_id: str, button_callback: Optional[str] = None) -> Optional[dict]:
-    step_map = {s["id"]: s for s in steps if s.get("id")}
-    current = step_map.get(step_id)
-    if not current:
-        return None
-    if button_callback:
-        transitions = current.get("transitions", [])
-        for t in transitions:
-            if t.get("on_callback") == button_callback:
-                return step_map.get(t["next_step_id"])
-    return step_map.get(current.get("next_step_id", ""))
+async def _play(
+    db: AsyncSession,
+    bot: Bot,
+    scenario: CompiledScenario,
+    user_id: int,
+    chat_id: int,
+    step: CompiledStep,
+    *,
+    delay_elapsed: bool = False,
+) -> bool:
+    """Send `step` and follow plain next_step_id links until a step waits for a button.
 
+    A step with a delay is scheduled instead of sent, replacing any step already pending
+    for the user in this scenario. The last step sent becomes the user's current step.
+    Returns False if `step` itself was only scheduled.
+    """
+    sent: Optional[CompiledStep] = None
+    scheduled = False
+    for _ in range(len(scenario.steps)):
+        if step.delay and not delay_elapsed:
+            try:
+                await schedule_step(user_id, scenario.id, chat_id, step.id, time.time() + step.delay)
+            except Exception as e:
+                # Progress below is still recorded; only the delayed step is lost.
+                logger.warning("Scenario %s step %s not scheduled for user %s: %s", scenario.id, step.id, user_id, e)
+            scheduled = True
+            break
+        delay_elapsed = False
+        await send_step(bot, chat_id, step)
+        sent = step
+        if step.transitions or not step.next_step_id:
+            break
+        step = scenario.steps[step.next_step_id]
+    if not scheduled:
+        try:
+            await cancel_delayed_step(user_id, scenario.id)
+        except Exception as e:
+            logger.warning("Delayed step cancel failed for user %s scenario %s: %s", user_id, scenario.id, e)
+    if sent is not None:
+        await set_current_step(db, user_id, scenario.id, sent.id)
+    return sent is not None
 
-def get_first_step(steps: list[dict]) -> Optional[dict]:
-    if not steps:
+
+async def start_scenario(
+    db: AsyncSession,
+    bot: Bot,
+    scenario: CompiledScenario,
+    user_id: int,
+    chat_id: int,
+) -> bool:
+    """True if the first step was sent now, False if it was scheduled (or there are no steps)."""
+    if scenario.first is None:
+        return False
+    return await _play(db, bot, scenario, user_id, chat_id, scenario.first)
+
+
+async def advance_scenario(
+    db: AsyncSession,
+    bot: Bot,
+    scenario: CompiledScenario,
+    user_id: int,
+    chat_id: int,
+    callback: str,
+) -> Optional[CompiledStep]:
+    """Follow a transition button; None if it does not belong to the user's current step."""
+    step_id = await get_current_step(db, user_id, scenario.id)
+    target = scenario.transition(step_id, callback) if step_id else None
+    if target is None:
         return None
-    first_id = steps[0].get("id")
-    if first_id:
-        return next((s for s in steps if s.get("id") == first_id), steps[0])
-    return steps[0]
+    await _play(db, bot, scenario, user_id, chat_id, target)
+    return target
+
+
+async def run_delayed_step(
+    db: AsyncSession,
+    bot: Bot,
+    scenario: CompiledScenario,
+    user_id: int,
+    chat_id: int,
+    step_id: str,
+) -> bool:
+    """Send a step whose delay has elapsed; False if the scenario no longer has it."""
+    step = scenario.step(step_id)
+    if step is None:
+        return False
+    await _play(db, bot, scenario, user_id, chat_id, step, delay_elapsed=True)
+    return True
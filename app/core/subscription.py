@@ -1,13 +1,17 @@
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import Row, exists, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from app.db.models import User, Subscription
 from app.db.models.subscription import PlanType, SubscriptionStatus
 from app.core.payments import plan_duration
+from app.core.entitlements import invalidate_on_commit
+from app.core.expiry_schedule import schedule_expiries, schedule_expiry
 
 logger = logging.getLogger(__name__)
 
@@ -64,5 +68,94 @@ async def create_subscription_after_payment(
         )
     db.add(sub)
     await db.flush()
+    await invalidate_on_commit(db, [user_id])
+    # Registered before commit: a rolled-back id is harmless, the poller re-checks the row.
+    await schedule_expiry(sub.id, sub.end_date)
     logger.info("Created subscription id=%s user_id=%s end_date=%s", sub.id, user_id, sub.end_date)
     return sub
+
+
+async def create_subscriptions_bulk(db: AsyncSession, items: Sequence[tuple[int, str]]) -> list[Row]:
+    """Set-based create_subscription_after_payment for many (user_id, plan_type) pairs.
+
+    Renewals stack as in the single-row version, including several payments of one user in
+    the same batch. Returns (id, user_id, end_date) rows; the caller commits and then calls
+    invalidate_committed().
+    """
+    if not items:
+        return []
+    now = datetime.now(timezone.utc)
+    user_ids = {user_id for user_id, _ in items}
+    result = await db.execute(
+        select(Subscription.user_id, Subscription.end_date)
+        .where(Subscription.user_id.in_(user_ids), Subscription.status == SubscriptionStatus.active)
+        .with_for_update()
+    )
+    paid_until: dict[int, datetime] = {}
+    for user_id, end_date in result.all():
+        end_date = end_date.replace(tzinfo=timezone.utc)
+        paid_until[user_id] = max(paid_until.get(user_id, end_date), end_date)
+    rows = []
+    for user_id, plan_type in items:
+        start = max(paid_until.get(user_id, now), now)
+        end = start + plan_duration(plan_type)
+        paid_until[user_id] = end
+        rows.append({
+            "user_id": user_id,
+            "plan_type": PlanType(plan_type),
+            "start_date": start,
+            "end_date": end,
+            "status": SubscriptionStatus.active,
+        })
+    result = await db.execute(
+        insert(Subscription).values(rows).returning(Subscription.id, Subscription.user_id, Subscription.end_date)
+    )
+    created = result.all()
+    await invalidate_on_commit(db, user_ids)
+    await schedule_expiries([(row.id, row.end_date) for row in created])
+    logger.info("Created %s subscriptions for %s users", len(created), len(user_ids))
+    return created
+
+
+@dataclass(slots=True)
+class ExpiredSubscription:
+    subscription_id: int
+    user_id: int
+    telegram_id: int
+    renewed: bool  # the user still has another active subscription (a prepaid renewal)
+
+
+async def expire_due_subscriptions(
+    db: AsyncSession,
+    now: datetime,
+    limit: int,
+    subscription_ids: Optional[Sequence[int]] = None,
+) -> list[ExpiredSubscription]:
+    """Mark up to `limit` due subscriptions expired in one UPDATE ... RETURNING.
+
+    Rows locked by a concurrent run are skipped. The caller commits.
+    """
+    due = (
+        select(Subscription.id)
+        .where(Subscription.status == SubscriptionStatus.active, Subscription.end_date <= now)
+        .order_by(Subscription.end_date)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    if subscription_ids is not None:
+        due = due.where(Subscription.id.in_(subscription_ids))
+    other = aliased(Subscription)
+    renewed = exists().where(
+        other.user_id == Subscription.user_id,
+        other.status == SubscriptionStatus.active,
+        other.end_date > now,
+    )
+    # Core table, not the entity: ORM-enabled UPDATE drops RETURNING columns of the FROM table.
+    subscriptions = Subscription.__table__
+    result = await db.execute(
+        update(subscriptions)
+        .where(subscriptions.c.user_id == User.id, subscriptions.c.id.in_(due.scalar_subquery()))
+        .values({subscriptions.c.status: SubscriptionStatus.expired})
+        .returning(subscriptions.c.id, subscriptions.c.user_id, User.telegram_id, renewed.label("renewed"))
+    )
+    return [ExpiredSubscription(*row) for row in result.all()]
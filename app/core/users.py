@@ -0,0 +1,128 @@
+import logging
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Optional
+
+from aiogram.types import User as TgUser
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.core.cache import TTLCache
+from app.core.entitlements import remember_entitlement
+from app.db.models import Subscription, User
+from app.db.models.subscription import SubscriptionStatus
+from app.db.models.user import UserRole, UserStatus
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+@dataclass(slots=True, frozen=True)
+class UserRecord:
+    """Compact, detached snapshot of a users row, safe to cache between updates."""
+
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    role: UserRole
+    status: UserStatus
+    tags: tuple[str, ...]
+
+
+_RECORD_COLUMNS = (
+    User.id, User.telegram_id, User.username, User.first_name,
+    User.last_name, User.role, User.status, User.tags,
+)
+
+# Latest active end_date, fetched in the same statement as the user row.
+_ACTIVE_UNTIL = (
+    select(func.max(Subscription.end_date))
+    .where(Subscription.user_id == User.id, Subscription.status == SubscriptionStatus.active)
+    .correlate(User)
+    .scalar_subquery()
+    .label("active_until")
+)
+
+_user_cache: TTLCache[UserRecord] = TTLCache(settings.user_cache_size, settings.user_cache_ttl)
+
+
+def _to_record(row) -> UserRecord:
+    return UserRecord(
+        id=row.id,
+        telegram_id=row.telegram_id,
+        username=row.username,
+        first_name=row.first_name,
+        last_name=row.last_name,
+        role=row.role,
+        status=row.status,
+        tags=tuple(row.tags or ()),
+    )
+
+
+def get_cached_user(telegram_id: int) -> Optional[UserRecord]:
+    return _user_cache.get(telegram_id)
+
+
+def cache_user(record: UserRecord) -> None:
+    _user_cache.set(record.telegram_id, record)
+
+
+def invalidate_user(telegram_id: int) -> None:
+    """Call after changing a user's tags, role or status."""
+    _user_cache.pop(telegram_id)
+
+
+async def _insert_user(db: AsyncSession, tg_user: TgUser) -> Optional[UserRecord]:
+    result = await db.execute(
+        insert(User)
+        .values(
+            telegram_id=tg_user.id,
+            username=tg_user.username,
+            first_name=tg_user.first_name,
+            last_name=tg_user.last_name,
+            role=UserRole.user,
+            status=UserStatus.active,
+            tags=[],
+        )
+        .on_conflict_do_nothing(index_elements=[User.telegram_id])
+        .returning(*_RECORD_COLUMNS)
+    )
+    row = result.one_or_none()
+    await db.commit()
+    if row is None:
+        return None
+    logger.info("Created user telegram_id=%s", tg_user.id)
+    return _to_record(row)
+
+
+async def _select_user(db: AsyncSession, telegram_id: int):
+    result = await db.execute(select(*_RECORD_COLUMNS, _ACTIVE_UNTIL).where(User.telegram_id == telegram_id))
+    return result.one_or_none()
+
+
+async def resolve_user(db: AsyncSession, tg_user: TgUser) -> UserRecord:
+    """Cached user record; on first contact the row is created with a single upsert.
+
+    A cache miss costs one statement, which also seeds the entitlement cache for the user.
+    """
+    record = get_cached_user(tg_user.id)
+    if record is not None:
+        return record
+    row = await _select_user(db, tg_user.id)
+    if row is None:
+        record = await _insert_user(db, tg_user)
+        if record is None:
+            # Lost an insert race with a concurrent update from the same user.
+            row = await _select_user(db, tg_user.id)
+    if row is not None:
+        record = _to_record(row)
+        until = row.active_until.replace(tzinfo=timezone.utc).timestamp() if row.active_until else 0.0
+    else:
+        until = 0.0
+    remember_entitlement(record.id, until)
+    cache_user(record)
+    return record
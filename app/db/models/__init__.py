@@ -2,7 +2,8 @@ from app.db.models.user import User
 from app.db.models.subscription import Subscription
 from app.db.models.payment import Payment
 from app.db.models.scenario import Scenario
-from app.db.models.broadcast import Broadcast
+from app.db.models.broadcast import Broadcast, BroadcastDelivery
 from app.db.models.user_scenario import UserScenarioProgress
+from app.db.models.outbox import OutboxEvent
 
-__all__ = ["User", "Subscription", "Payment", "Scenario", "Broadcast", "UserScenarioProgress"]
+__all__ = ["User", "Subscription", "Payment", "Scenario", "Broadcast", "BroadcastDelivery", "UserScenarioProgress", "OutboxEvent"]
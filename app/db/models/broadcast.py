@@ -2,7 +2,7 @@ import enum
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import DateTime, Enum, Integer, String, func
+from sqlalchemy import BigInteger, DateTime, Enum, ForeignKey, Integer, SmallInteger, String, func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -23,11 +23,16 @@ class BroadcastStatus(str, enum.Enum):
     failed = "failed"
 
 
+class DeliveryStatus(str, enum.Enum):
+    sent = "sent"
+    failed = "failed"
+
+
 class Broadcast(Base):
     __tablename__ = "broadcasts"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    content: Mapped[dict] = mapped_column(JSONB, nullable=False)  # {"text": "...", "photo": "...", "video": "..."}
+    content: Mapped[dict] = mapped_column(JSONB, nullable=False)  # {"text": "...", "photo"|"video": file_id or URL} or {"source": {"chat_id": ..., "message_id": ...}}
     segment: Mapped[BroadcastSegment] = mapped_column(Enum(BroadcastSegment), nullable=False)
     segment_tag: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     status: Mapped[BroadcastStatus] = mapped_column(Enum(BroadcastStatus), default=BroadcastStatus.draft, nullable=False)
@@ -37,3 +42,18 @@ class Broadcast(Base):
 
     def __repr__(self) -> str:
         return f"<Broadcast id={self.id} segment={self.segment} status={self.status}>"
+
+
+class BroadcastDelivery(Base):
+    """Per-recipient ledger: lets an interrupted broadcast resume without resending."""
+
+    __tablename__ = "broadcast_deliveries"
+
+    broadcast_id: Mapped[int] = mapped_column(ForeignKey("broadcasts.id", ondelete="CASCADE"), primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    status: Mapped[DeliveryStatus] = mapped_column(Enum(DeliveryStatus), nullable=False)
+    error_code: Mapped[Optional[int]] = mapped_column(SmallInteger, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"<BroadcastDelivery broadcast_id={self.broadcast_id} telegram_id={self.telegram_id} status={self.status}>"
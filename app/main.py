@@ -5,6 +5,10 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 from app.config import get_settings
+from app.bot.loader import close_bot, get_bot, get_dispatcher
+from app.bot.update_queue import start_update_queue, stop_update_queue
+from app.services import telegram_api
+from app.services.redis_client import close_redis, startup_redis
 from app.api.routes import health, webhook_telegram, webhook_payment
 
 logging.basicConfig(
@@ -25,12 +29,14 @@ BOT_DESCRIPTION = (
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await telegram_api.startup_client()
+    await startup_redis()
     try:
-        from aiogram import Bot
         from aiogram.types import BotCommand, MenuButtonCommands
         settings = get_settings()
         if settings.telegram_bot_token:
-            bot = Bot(token=settings.telegram_bot_token)
+            # Shared with the webhook route: its aiohttp session stays open until shutdown.
+            bot = get_bot()
             await bot.set_my_commands([
                 BotCommand(command="start", description="🍌 Начать — приветствие и меню"),
                 BotCommand(command="help", description="Помощь / Служба заботы"),
@@ -39,11 +45,22 @@ async def lifespan(app: FastAPI):
             # Описание и «О боте» — без HTML (Telegram их не поддерживает)
             await bot.set_my_short_description(short_description=BOT_SHORT_DESCRIPTION)
             await bot.set_my_description(description=BOT_DESCRIPTION)
-            await bot.session.close()
             logger.info("Bot menu and description set.")
     except Exception as e:
         logger.warning("Could not set bot menu/description: %s", e)
+    settings = get_settings()
+    if settings.telegram_webhook_mode == "queue":
+        dp, bot = get_dispatcher(), get_bot()
+        await start_update_queue(
+            lambda update: dp.feed_update(bot, update),
+            workers=settings.update_queue_workers,
+            max_depth=settings.update_queue_max_depth,
+        )
     yield
+    await stop_update_queue()
+    await close_bot()
+    await telegram_api.close_client()
+    await close_redis()
     logger.info("Shutdown complete.")
 
 
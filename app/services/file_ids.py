@@ -0,0 +1,128 @@
+"""
+Telegram file_id cache: media is uploaded once, later sends reference it by file_id.
+
+Keys: sha256 of the file content for local files, sha256 of the URL for remote media.
+file_ids are stable for a bot, so entries live in a Redis hash without expiry, with an
+in-process copy in front of it.
+"""
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, TypeVar, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputFile
+
+from app.core.cache import TTLCache
+from app.services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+FILE_IDS_KEY = "telegram:file_ids"
+LOCAL_CACHE_SIZE = 10_000
+
+MediaSource = Union[str, Path]
+T = TypeVar("T")
+
+_local: TTLCache[str] = TTLCache(LOCAL_CACHE_SIZE, float("inf"))
+# (path, mtime_ns, size) -> content hash, so a file is read once per change.
+_path_hashes: dict[tuple[str, int, int], str] = {}
+
+
+def _is_url(source: MediaSource) -> bool:
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def media_key(source: MediaSource) -> Optional[str]:
+    """Cache key for a local path or URL; None for anything else (e.g. already a file_id)."""
+    if _is_url(source):
+        return "url:" + hashlib.sha256(source.encode()).hexdigest()
+    if isinstance(source, Path):
+        stat = source.stat()
+        marker = (str(source), stat.st_mtime_ns, stat.st_size)
+        digest = _path_hashes.get(marker)
+        if digest is None:
+            digest = await asyncio.to_thread(_hash_file, source)
+            _path_hashes[marker] = digest
+        return "sha256:" + digest
+    return None
+
+
+async def get_file_id(key: str) -> Optional[str]:
+    file_id = _local.get(key)
+    if file_id is not None:
+        return file_id
+    try:
+        file_id = await get_redis().hget(FILE_IDS_KEY, key)
+    except Exception as e:
+        logger.warning("file_id cache read failed: %s", e)
+        return None
+    if file_id is not None:
+        _local.set(key, file_id)
+    return file_id
+
+
+async def remember_file_id(key: str, file_id: str) -> None:
+    _local.set(key, file_id)
+    try:
+        await get_redis().hset(FILE_IDS_KEY, key, file_id)
+    except Exception as e:
+        logger.warning("file_id cache write failed: %s", e)
+
+
+async def forget_file_id(key: str) -> None:
+    _local.pop(key)
+    try:
+        await get_redis().hdel(FILE_IDS_KEY, key)
+    except Exception as e:
+        logger.warning("file_id cache delete failed: %s", e)
+
+
+def file_id_of(sent: Any, kind: str) -> Optional[str]:
+    """file_id of the `kind` media in a sent message (aiogram Message or raw API dict)."""
+    media = sent.get(kind) if isinstance(sent, dict) else getattr(sent, kind, None)
+    if isinstance(media, list):
+        media = media[-1] if media else None  # photo sizes, largest last
+    if media is None:
+        return None
+    return media.get("file_id") if isinstance(media, dict) else media.file_id
+
+
+def _as_input(source: MediaSource) -> Union[str, InputFile]:
+    return FSInputFile(source) if isinstance(source, Path) else source
+
+
+async def send_cached_media(
+    source: MediaSource,
+    kind: str,
+    send: Callable[[Union[str, InputFile]], Awaitable[T]],
+) -> T:
+    """Call `send` with the cached file_id, or with the original media on the first send.
+
+    kind: "photo" | "video" | "audio" | "document". A file_id Telegram rejects is dropped
+    and the media is sent (and cached) again.
+    """
+    key = await media_key(source)
+    if key is not None:
+        file_id = await get_file_id(key)
+        if file_id is not None:
+            try:
+                return await send(file_id)
+            except TelegramBadRequest as e:
+                logger.warning("Cached file_id for %s rejected, re-uploading: %s", source, e)
+                await forget_file_id(key)
+    sent = await send(_as_input(source))
+    if key is not None:
+        file_id = file_id_of(sent, kind)
+        if file_id:
+            await remember_file_id(key, file_id)
+    return sent
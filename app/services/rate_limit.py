@@ -0,0 +1,116 @@
+import asyncio
+import time
+from typing import Optional
+
+from redis import asyncio as aioredis
+
+
+class TokenBucket:
+    """Global send budget: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (Telegram flood control)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Refill starts when the pause ends, so there is no burst right after it.
+        self._updated = self._paused_until
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# KEYS[1] = bucket hash; ARGV = rate, capacity, pause_seconds.
+# Returns seconds to wait before retrying (as a string; "0" means a token was taken).
+_REDIS_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local pause = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'paused_until')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+local paused_until = tonumber(state[3]) or 0
+local wait = 0
+if pause > 0 then
+  paused_until = math.max(paused_until, now + pause)
+  tokens = 0
+elseif now < paused_until then
+  wait = paused_until - now
+else
+  tokens = math.min(capacity, tokens + (now - ts) * rate)
+  if tokens >= 1 then
+    tokens = tokens - 1
+  else
+    wait = (1 - tokens) / rate
+  end
+end
+-- While paused, refill is counted from the end of the pause.
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', math.max(now, paused_until), 'paused_until', paused_until)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """TokenBucket whose state lives in Redis, so every worker draws from one budget."""
+
+    def __init__(self, redis: aioredis.Redis, key: str, rate: float, capacity: Optional[float] = None) -> None:
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._script = redis.register_script(_REDIS_BUCKET_LUA)
+
+    async def _eval(self, pause: float) -> float:
+        return float(await self._script(keys=[self.key], args=[self.rate, self.capacity, pause]))
+
+    async def pause(self, seconds: float) -> None:
+        await self._eval(seconds)
+
+    async def acquire(self) -> None:
+        while (wait := await self._eval(0)) > 0:
+            await asyncio.sleep(wait)
+
+
+class ChatPacer:
+    """Keeps at least `interval` seconds between two sends to the same chat."""
+
+    _PRUNE_AT = 10_000
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next_at: dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        now = time.monotonic()
+        next_at = self._next_at.get(chat_id, 0.0)
+        if next_at > now:
+            self._next_at[chat_id] = next_at + self.interval
+            await asyncio.sleep(next_at - now)
+        else:
+            self._next_at[chat_id] = now + self.interval
+        if len(self._next_at) > self._PRUNE_AT:
+            self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        self._next_at = {k: v for k, v in self._next_at.items() if v > now}
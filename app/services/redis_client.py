@@ -0,0 +1,52 @@
+"""
+Process-wide async Redis pool shared by the payment front-cache, FSM storage, caches and tasks.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from redis import asyncio as aioredis
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_redis: Optional[aioredis.Redis] = None
+_redis_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _build_client() -> aioredis.Redis:
+    pool = aioredis.BlockingConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+        decode_responses=True,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+def get_redis() -> aioredis.Redis:
+    """Process-wide Redis client, rebuilt if the running event loop has changed."""
+    global _redis, _redis_loop
+    loop = asyncio.get_running_loop()
+    if _redis is None or _redis_loop is not loop:
+        _redis = _build_client()
+        _redis_loop = loop
+    return _redis
+
+
+async def startup_redis() -> None:
+    """Create the pool up front (FastAPI lifespan, worker start) and check the server is reachable."""
+    try:
+        await get_redis().ping()
+    except Exception as e:
+        logger.warning("Redis is not reachable at startup: %s", e)
+
+
+async def close_redis() -> None:
+    global _redis, _redis_loop
+    client, _redis, _redis_loop = _redis, None, None
+    if client is not None:
+        await client.aclose(close_connection_pool=True)
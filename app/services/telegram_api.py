@@ -1,5 +1,7 @@
+import asyncio
 import logging
-from typing import Optional
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import httpx
 
@@ -10,73 +12,152 @@ settings = get_settings()
 
 BASE_URL = "https://api.telegram.org/bot{token}"
 
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.telegram_http_pool_size,
+        max_keepalive_connections=settings.telegram_http_pool_size,
+        keepalive_expiry=settings.telegram_http_keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        base_url=BASE_URL.format(token=settings.telegram_bot_token),
+        limits=limits,
+        timeout=httpx.Timeout(settings.telegram_http_timeout),
+        http2=settings.telegram_http2,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide pooled client, rebuilt if the running event loop has changed."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        # A client bound to a previous (closed) loop cannot be reused or closed cleanly.
+        _client = _build_client()
+        _client_loop = loop
+    return _client
+
+
+async def startup_client() -> None:
+    get_client()
+    logger.info(
+        "Telegram HTTP client started (pool=%s, http2=%s)",
+        settings.telegram_http_pool_size,
+        settings.telegram_http2,
+    )
+
+
+async def close_client() -> None:
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+@dataclass(slots=True)
+class ApiResult:
+    ok: bool
+    error_code: Optional[int] = None
+    description: Optional[str] = None
+    retry_after: Optional[float] = None
+    result: Any = None
+
+
+async def _post(method: str, payload: dict[str, Any]) -> dict[str, Any]:
+    r = await get_client().post(f"/{method}", json=payload)
+    return r.json()
+
+
+async def call_api(method: str, payload: dict[str, Any]) -> ApiResult:
+    """Like the helpers below, but keeps error_code / retry_after for callers that retry."""
+    try:
+        data = await _post(method, payload)
+    except Exception as e:
+        logger.warning("%s transport error: %s", method, e)
+        return ApiResult(ok=False, description=str(e))
+    if data.get("ok"):
+        return ApiResult(ok=True, result=data.get("result"))
+    params = data.get("parameters") or {}
+    return ApiResult(
+        ok=False,
+        error_code=data.get("error_code"),
+        description=data.get("description"),
+        retry_after=params.get("retry_after"),
+    )
+
 
 async def create_chat_invite_link(chat_id: int, member_limit: int = 1) -> Optional[str]:
-    url = BASE_URL.format(token=settings.telegram_bot_token) + "/createChatInviteLink"
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(
-                url,
-                json={"chat_id": chat_id, "member_limit": member_limit},
-                timeout=10.0,
-            )
-            data = r.json()
-            if not data.get("ok"):
-                logger.warning("createChatInviteLink failed: %s", data)
-                return None
-            return data.get("result", {}).get("invite_link")
-        except Exception as e:
-            logger.exception("createChatInviteLink error: %s", e)
+    try:
+        data = await _post("createChatInviteLink", {"chat_id": chat_id, "member_limit": member_limit})
+        if not data.get("ok"):
+            logger.warning("createChatInviteLink failed: %s", data)
             return None
+        return data.get("result", {}).get("invite_link")
+    except Exception as e:
+        logger.exception("createChatInviteLink error: %s", e)
+        return None
 
 
 async def revoke_chat_invite_link(chat_id: int, invite_link: str) -> bool:
-    url = BASE_URL.format(token=settings.telegram_bot_token) + "/revokeChatInviteLink"
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(url, json={"chat_id": chat_id, "invite_link": invite_link}, timeout=10.0)
-            return r.json().get("ok", False)
-        except Exception as e:
-            logger.exception("revokeChatInviteLink error: %s", e)
-            return False
+    try:
+        data = await _post("revokeChatInviteLink", {"chat_id": chat_id, "invite_link": invite_link})
+        return data.get("ok", False)
+    except Exception as e:
+        logger.exception("revokeChatInviteLink error: %s", e)
+        return False
 
 
 async def kick_chat_member(chat_id: int, user_id: int) -> bool:
-    url = BASE_URL.format(token=settings.telegram_bot_token) + "/banChatMember"
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(url, json={"chat_id": chat_id, "user_id": user_id}, timeout=10.0)
-            data = r.json()
-            if not data.get("ok"):
-                logger.warning("kick_chat_member failed: %s", data)
-                return False
-            return True
-        except Exception as e:
-            logger.exception("kick_chat_member error: %s", e)
+    try:
+        data = await _post("banChatMember", {"chat_id": chat_id, "user_id": user_id})
+        if not data.get("ok"):
+            logger.warning("kick_chat_member failed: %s", data)
             return False
+        return True
+    except Exception as e:
+        logger.exception("kick_chat_member error: %s", e)
+        return False
+
+
+async def ban_chat_member_result(chat_id: int, user_id: int) -> ApiResult:
+    return await call_api("banChatMember", {"chat_id": chat_id, "user_id": user_id})
 
 
 async def unban_chat_member(chat_id: int, user_id: int) -> bool:
-    url = BASE_URL.format(token=settings.telegram_bot_token) + "/unbanChatMember"
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(url, json={"chat_id": chat_id, "user_id": user_id}, timeout=10.0)
-            return r.json().get("ok", False)
-        except Exception as e:
-            logger.exception("unban_chat_member error: %s", e)
-            return False
+    try:
+        data = await _post("unbanChatMember", {"chat_id": chat_id, "user_id": user_id})
+        return data.get("ok", False)
+    except Exception as e:
+        logger.exception("unban_chat_member error: %s", e)
+        return False
+
+
+async def send_message_result(chat_id: int, text: str) -> ApiResult:
+    return await call_api("sendMessage", {"chat_id": chat_id, "text": text, "parse_mode": "HTML"})
+
+
+async def copy_message(chat_id: int, from_chat_id: int, message_id: int) -> ApiResult:
+    return await call_api(
+        "copyMessage",
+        {"chat_id": chat_id, "from_chat_id": from_chat_id, "message_id": message_id},
+    )
+
+
+async def send_media(chat_id: int, kind: str, media: str, caption: Optional[str] = None) -> ApiResult:
+    """sendPhoto / sendVideo with a file_id or URL; `kind` is "photo" or "video"."""
+    payload: dict[str, Any] = {"chat_id": chat_id, kind: media}
+    if caption:
+        payload.update(caption=caption, parse_mode="HTML")
+    return await call_api("send" + kind.capitalize(), payload)
 
 
 async def send_message(chat_id: int, text: str) -> bool:
-    url = BASE_URL.format(token=settings.telegram_bot_token) + "/sendMessage"
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.post(
-                url,
-                json={"chat_id": chat_id, "text": text, "parse_mode": "HTML"},
-                timeout=10.0,
-            )
-            return r.json().get("ok", False)
-        except Exception as e:
-            logger.exception("send_message error: %s", e)
-            return False
+    try:
+        data = await _post("sendMessage", {"chat_id": chat_id, "text": text, "parse_mode": "HTML"})
+        return data.get("ok", False)
+    except Exception as e:
+        logger.exception("send_message error: %s", e)
+        return False
@@ -0,0 +1,153 @@
+"""
+Concurrent, rate-limited delivery of Telegram API calls to many chats.
+"""
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional
+
+from app.config import get_settings
+from app.services.rate_limit import ChatPacer, RedisTokenBucket, TokenBucket
+from app.services.redis_client import get_redis
+from app.services.telegram_api import ApiResult
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SendFn = Callable[[int], Awaitable[ApiResult]]
+
+# One bucket for every worker and job: the Telegram limit is per bot.
+SEND_BUCKET_KEY = "telegram:send_bucket"
+
+
+def shared_bucket() -> RedisTokenBucket:
+    return RedisTokenBucket(get_redis(), SEND_BUCKET_KEY, settings.telegram_rate_limit)
+
+
+@dataclass(slots=True)
+class Delivery:
+    chat_id: int
+    ok: bool
+    error_code: Optional[int] = None
+
+
+@dataclass(slots=True)
+class DeliveryStats:
+    sent: int = 0
+    failed: int = 0
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed
+
+    def add(self, delivery: Delivery) -> None:
+        if delivery.ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+            self.errors[str(delivery.error_code or "network")] += 1
+
+
+def retryable_error(error_code: Optional[int]) -> bool:
+    # No error_code means a transport error (timeout, connection reset).
+    return error_code is None or error_code == 429 or error_code >= 500
+
+
+def _retryable(res: ApiResult) -> bool:
+    return retryable_error(res.error_code)
+
+
+class TelegramSender:
+    def __init__(
+        self,
+        bucket: TokenBucket | RedisTokenBucket,
+        pacer: ChatPacer,
+        concurrency: int,
+        max_retries: int,
+    ) -> None:
+        self.bucket = bucket
+        self.pacer = pacer
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_settings(cls, bucket: Optional[TokenBucket | RedisTokenBucket] = None) -> "TelegramSender":
+        return cls(
+            bucket=bucket or TokenBucket(settings.telegram_rate_limit),
+            pacer=ChatPacer(settings.telegram_per_chat_interval),
+            concurrency=settings.broadcast_concurrency,
+            max_retries=settings.telegram_max_retries,
+        )
+
+    async def send(self, chat_id: int, send: SendFn) -> Delivery:
+        res = ApiResult(ok=False)
+        for attempt in range(self.max_retries + 1):
+            await self.pacer.wait(chat_id)
+            await self.bucket.acquire()
+            res = await send(chat_id)
+            if res.ok:
+                return Delivery(chat_id, True)
+            if not _retryable(res) or attempt == self.max_retries:
+                break
+            if res.retry_after:
+                logger.warning("Flood control: retry_after=%ss (chat %s)", res.retry_after, chat_id)
+                await self.bucket.pause(res.retry_after)
+            else:
+                await asyncio.sleep(2 ** attempt)
+        return Delivery(chat_id, False, res.error_code)
+
+    async def _send_safe(self, chat_id: int, send: SendFn) -> Delivery:
+        try:
+            return await self.send(chat_id, send)
+        except Exception as e:
+            logger.warning("Send to %s failed: %s", chat_id, e)
+            return Delivery(chat_id, False)
+
+    async def send_many(self, chat_ids: Iterable[int], send: SendFn) -> list[Delivery]:
+        """Deliver to every chat with at most `concurrency` requests in flight."""
+        it = iter(chat_ids)
+        results: list[Delivery] = []
+
+        async def worker() -> None:
+            for chat_id in it:
+                results.append(await self._send_safe(chat_id, send))
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return results
+
+    async def send_stream(
+        self,
+        chunks: AsyncIterable[Iterable[int]],
+        send: SendFn,
+        on_delivery: Optional[Callable[["Delivery"], Awaitable[None]]] = None,
+    ) -> DeliveryStats:
+        """Like send_many, but starts sending while later chunks are still being produced."""
+        queue: asyncio.Queue[Optional[int]] = asyncio.Queue(maxsize=self.concurrency * 4)
+        stats = DeliveryStats()
+
+        async def produce() -> None:
+            async for chunk in chunks:
+                for chat_id in chunk:
+                    await queue.put(chat_id)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def worker() -> None:
+            while (chat_id := await queue.get()) is not None:
+                delivery = await self._send_safe(chat_id, send)
+                stats.add(delivery)
+                if on_delivery is not None:
+                    await on_delivery(delivery)
+
+        tasks = [asyncio.create_task(produce()), *(asyncio.create_task(worker()) for _ in range(self.concurrency))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On cancellation or a failed task nobody drains the queue: stop the rest explicitly
+            # instead of leaving the producer blocked on a full queue.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return stats
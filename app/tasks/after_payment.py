@@ -1,5 +1,10 @@
 import logging
+from typing import Optional
+
 from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
+from app.core.invite_pool import take_invite_link
+from app.core.outbox import claim_outbox_event, release_outbox_event
 from app.services.telegram_api import create_chat_invite_link, send_message
 from app.config import get_settings
 
@@ -7,31 +12,38 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
-@celery_app.task(bind=True, max_retries=3)
-def send_subscription_invite(self, telegram_id: int) -> None:
+async def _send_invite_impl(telegram_id: int, outbox_id: Optional[int] = None) -> None:
+    # The outbox may deliver an event twice: only the first delivery sends an invite.
+    if not await claim_outbox_event(outbox_id):
+        logger.info("Invite for outbox event id=%s already sent to %s", outbox_id, telegram_id)
+        return
+    sent = False
     try:
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            link = loop.run_until_complete(
-                create_chat_invite_link(settings.private_group_id, member_limit=1)
+        # The pool is refilled in the background; creating a link here is the fallback.
+        link = await take_invite_link() or await create_chat_invite_link(settings.private_group_id, member_limit=1)
+        if link:
+            sent = await send_message(
+                telegram_id,
+                "<b>Оплата прошла успешно</b>\n\n"
+                "Ваша подписка активирована.\n\n"
+                f"Вступить в закрытую группу: {link}\n\n"
+                "Ссылка одноразовая.",
             )
-            if link:
-                loop.run_until_complete(
-                    send_message(
-                        telegram_id,
-                        "<b>Оплата прошла успешно</b>\n\n"
-                        "Ваша подписка активирована.\n\n"
-                        f"Вступить в закрытую группу: {link}\n\n"
-                        "Ссылка одноразовая.",
-                    )
-                )
+            if sent:
                 logger.info("Sent invite to %s", telegram_id)
             else:
-                logger.warning("Could not create invite link for %s", telegram_id)
-        finally:
-            loop.close()
+                logger.warning("Invite to %s not delivered", telegram_id)
+        else:
+            logger.warning("Could not create invite link for %s", telegram_id)
+    finally:
+        if not sent:
+            await release_outbox_event(outbox_id)
+
+
+@celery_app.task(bind=True, max_retries=3)
+def send_subscription_invite(self, telegram_id: int, outbox_id: Optional[int] = None) -> None:
+    try:
+        run_async(_send_invite_impl(telegram_id, outbox_id))
     except Exception as exc:
         logger.exception("send_subscription_invite failed: %s", exc)
         raise self.retry(exc=exc, countdown=60)
@@ -1,65 +1,199 @@
 import asyncio
 import logging
+import uuid
 from datetime import datetime, timezone
+from typing import Optional
 
-from sqlalchemy import select
+from celery import group
+from sqlalchemy import select, update
 
 from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
 from app.db.session import async_session_maker
 from app.db.models import Broadcast
 from app.db.models.broadcast import BroadcastStatus
-from app.core.broadcast import get_recipients
-from app.services.telegram_api import send_message
+from app.core.broadcast import (
+    ContentSender,
+    DeliveryLedger,
+    build_stats,
+    cached_media_content,
+    iter_recipients,
+    needs_media_upload,
+    remember_media_content,
+    send_content,
+    split_user_id_range,
+    with_file_id,
+)
+from app.services.redis_client import get_redis
+from app.services.telegram_sender import TelegramSender, shared_bucket
+from app.config import get_settings
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
+# Per run: completions of an earlier plan's shards never count towards a later one.
+SHARDS_DONE_KEY = "broadcast:{broadcast_id}:{run_id}:shards_done"
+# Id of the run (plan) that owns a broadcast in `sending`; its shards keep it alive.
+LEASE_KEY = "broadcast:{broadcast_id}:lease"
 
-def _run_async(coro):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+# Take a free lease or extend our own: ARGV[1] = run id, ARGV[2] = ttl in seconds.
+_HOLD_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+_RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def _hold_lease(broadcast_id: int, run_id: str) -> bool:
+    hold = get_redis().register_script(_HOLD_LEASE_LUA)
+    return bool(await hold(keys=[LEASE_KEY.format(broadcast_id=broadcast_id)], args=[run_id, settings.broadcast_lease_ttl]))
 
 
-async def _send_broadcast_impl(broadcast_id: int) -> dict:
+async def _release_lease(broadcast_id: int, run_id: str) -> None:
+    release = get_redis().register_script(_RELEASE_LEASE_LUA)
+    await release(keys=[LEASE_KEY.format(broadcast_id=broadcast_id)], args=[run_id])
+
+
+async def _heartbeat(broadcast_id: int, run_id: str, sending: asyncio.Future) -> None:
+    """Extend the lease while the shard sends; stop the shard if another run took it over."""
+    while True:
+        await asyncio.sleep(settings.broadcast_lease_ttl / 3)
+        try:
+            held = await _hold_lease(broadcast_id, run_id)
+        except Exception as e:
+            logger.warning("Broadcast id=%s lease refresh failed: %s", broadcast_id, e)
+            continue
+        if not held:
+            logger.warning("Broadcast id=%s taken over by another run, stopping shard", broadcast_id)
+            sending.cancel()
+            return
+
+
+async def _plan_broadcast(broadcast_id: int) -> dict:
+    run_id = uuid.uuid4().hex
     async with async_session_maker() as db:
         result = await db.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
         broadcast = result.scalar_one_or_none()
-        if not broadcast or broadcast.status != BroadcastStatus.draft:
+        if not broadcast or broadcast.status not in (BroadcastStatus.draft, BroadcastStatus.sending):
             return {"ok": False, "reason": "not_found_or_not_draft"}
+        # A broadcast left in `sending` is resumed from its delivery ledger only once the
+        # previous run's lease has expired, i.e. none of its shards is still sending.
+        if not await _hold_lease(broadcast_id, run_id):
+            logger.info("Broadcast id=%s is being sent by another run, skip", broadcast_id)
+            return {"ok": False, "reason": "already_sending"}
+        if broadcast.status == BroadcastStatus.sending:
+            logger.info("Resuming broadcast id=%s", broadcast_id)
         broadcast.status = BroadcastStatus.sending
+        # Every shard should send a file_id instead of the URL: reuse a cached one or upload once here.
+        broadcast.content = await cached_media_content(broadcast.content)
+        if settings.broadcast_media_chat_id and needs_media_upload(broadcast.content):
+            res = await send_content(settings.broadcast_media_chat_id, broadcast.content)
+            if res.ok:
+                broadcast.content = with_file_id(broadcast.content, res.result or {})
+                await remember_media_content(broadcast.content)
+            else:
+                logger.warning("Broadcast id=%s media pre-upload failed: %s", broadcast_id, res.description)
+        shards = await split_user_id_range(db, settings.broadcast_shards)
         await db.commit()
+    if not shards:
+        await _finalize_broadcast(broadcast_id, run_id)
+    return {"ok": True, "shards": shards, "run_id": run_id}
+
 
-    from app.db.models.broadcast import BroadcastSegment
+async def _send_shard_impl(broadcast_id: int, after_id: int, until_id: int, shard_count: int, run_id: str) -> dict:
     async with async_session_maker() as db:
-        recipients = await get_recipients(db, broadcast.segment, broadcast.segment_tag)
-        content = broadcast.content
-        text = content.get("text", "")
-        sent = 0
-        failed = 0
-        for telegram_id in recipients:
+        result = await db.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
+        broadcast = result.scalar_one_or_none()
+        if not broadcast or broadcast.status != BroadcastStatus.sending:
+            return {"ok": False, "reason": "not_sending"}
+    # Shards of a superseded plan (or queued before a deploy, without run_id) do nothing.
+    if not run_id or not await _hold_lease(broadcast_id, run_id):
+        return {"ok": False, "reason": "superseded"}
+
+    redis = get_redis()
+    sender = TelegramSender.from_settings(shared_bucket())
+    ledger = DeliveryLedger(broadcast_id)
+    try:
+        async with async_session_maker() as db:
+            sending = asyncio.ensure_future(sender.send_stream(
+                iter_recipients(
+                    db, broadcast.segment, broadcast.segment_tag,
+                    skip_delivered_for=broadcast_id, after_id=after_id, until_id=until_id,
+                ),
+                ContentSender(broadcast.content),
+                on_delivery=ledger.record,
+            ))
+            heartbeat = asyncio.create_task(_heartbeat(broadcast_id, run_id, sending))
             try:
-                ok = await send_message(telegram_id, text)
-                if ok:
-                    sent += 1
-                else:
-                    failed += 1
-            except Exception as e:
-                logger.warning("Broadcast send failed %s: %s", telegram_id, e)
-                failed += 1
+                stats = await sending
+            except asyncio.CancelledError:
+                # The heartbeat only finishes on its own after cancelling the shard.
+                if not heartbeat.done():
+                    raise
+                return {"ok": False, "reason": "superseded"}
+            finally:
+                heartbeat.cancel()
+    finally:
+        await ledger.flush()
 
+    # A set of finished ranges (not a counter) so a redelivered shard is not counted twice.
+    done_key = SHARDS_DONE_KEY.format(broadcast_id=broadcast_id, run_id=run_id)
+    await redis.sadd(done_key, f"{after_id}:{until_id}")
+    await redis.expire(done_key, 86400)
+    if await redis.scard(done_key) >= shard_count:
+        await _finalize_broadcast(broadcast_id, run_id)
+    return {"sent": stats.sent, "failed": stats.failed, "total": stats.total}
+
+
+async def _finalize_broadcast(broadcast_id: int, run_id: str) -> Optional[dict]:
+    """Merge the shards' results (via the ledger) into Broadcast.stats, exactly once."""
     async with async_session_maker() as db:
-        result = await db.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
-        broadcast = result.scalar_one()
-        broadcast.status = BroadcastStatus.completed
-        broadcast.stats = {"total": len(recipients), "sent": sent, "failed": failed}
-        broadcast.completed_at = datetime.now(timezone.utc)
+        stats = await build_stats(db, broadcast_id)
+        result = await db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == BroadcastStatus.sending)
+            .values(
+                status=BroadcastStatus.completed,
+                stats=stats,
+                completed_at=datetime.now(timezone.utc),
+            )
+        )
         await db.commit()
-    return {"sent": sent, "failed": failed, "total": len(recipients)}
+    await _release_lease(broadcast_id, run_id)
+    if result.rowcount:
+        logger.info("Broadcast id=%s completed: %s", broadcast_id, stats)
+        return stats
+    return None
 
 
 @celery_app.task
 def run_broadcast(broadcast_id: int) -> dict:
-    return _run_async(_send_broadcast_impl(broadcast_id))
+    plan = run_async(_plan_broadcast(broadcast_id))
+    if not plan["ok"]:
+        return plan
+    shards = plan["shards"]
+    if not shards:
+        # No recipients: _plan_broadcast has already finalized it with empty stats.
+        logger.info("Broadcast id=%s has no recipients", broadcast_id)
+        return {"ok": True, "shards": 0}
+    group(
+        send_broadcast_shard.s(broadcast_id, after_id, until_id, len(shards), plan["run_id"])
+        for after_id, until_id in shards
+    ).apply_async()
+    logger.info("Broadcast id=%s dispatched in %s shards", broadcast_id, len(shards))
+    return {"ok": True, "shards": len(shards)}
+
+
+@celery_app.task(acks_late=True)
+def send_broadcast_shard(broadcast_id: int, after_id: int, until_id: int, shard_count: int, run_id: str = "") -> dict:
+    return run_async(_send_shard_impl(broadcast_id, after_id, until_id, shard_count, run_id))
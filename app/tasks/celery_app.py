@@ -11,6 +11,10 @@ celery_app = Celery(
         "app.tasks.after_payment",
         "app.tasks.broadcast_tasks",
         "app.tasks.scenario_delayed",
+        "app.tasks.scenario_progress",
+        "app.tasks.outbox_relay",
+        "app.tasks.invite_pool",
+        "app.tasks.payment_stream",
     ],
 )
 celery_app.conf.update(
@@ -26,4 +30,29 @@ celery_app.conf.beat_schedule = {
         "task": "app.tasks.subscription_expiry.expire_subscriptions",
         "schedule": 86400.0,
     },
+    "poll-subscription-expiry": {
+        "task": "app.tasks.subscription_expiry.poll_subscription_expiry",
+        "schedule": settings.expiry_poll_interval,
+    },
+    "flush-scenario-progress": {
+        "task": "app.tasks.scenario_progress.flush_scenario_progress",
+        "schedule": settings.scenario_flush_interval,
+    },
+    "dispatch-delayed-scenario-steps": {
+        "task": "app.tasks.scenario_delayed.dispatch_delayed_steps",
+        "schedule": settings.scenario_delay_poll_interval,
+    },
+    "relay-outbox": {
+        "task": "app.tasks.outbox_relay.relay_outbox",
+        "schedule": settings.outbox_relay_interval,
+    },
+    "maintain-invite-pool": {
+        "task": "app.tasks.invite_pool.maintain_invite_pool",
+        "schedule": settings.invite_pool_interval,
+    },
 }
+if settings.payment_webhook_mode == "stream":
+    celery_app.conf.beat_schedule["consume-payment-stream"] = {
+        "task": "app.tasks.payment_stream.consume_payment_stream",
+        "schedule": settings.payment_stream_poll_interval,
+    }
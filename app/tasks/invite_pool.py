@@ -0,0 +1,68 @@
+"""
+Invite link pool upkeep: retire and revoke aged links, then refill to INVITE_POOL_SIZE.
+"""
+import logging
+
+from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
+from app.core.invite_pool import (
+    create_pooled_link,
+    pool_size,
+    requeue_revoke,
+    retire_aged_links,
+    take_links_to_revoke,
+)
+from app.services.rate_limit import RedisTokenBucket
+from app.services.telegram_api import call_api
+from app.services.telegram_sender import shared_bucket
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+REVOKE_BATCH_SIZE = 200
+
+
+async def _revoke_aged(bucket: RedisTokenBucket) -> None:
+    retired = await retire_aged_links()
+    links = await take_links_to_revoke(REVOKE_BATCH_SIZE)
+    failed = []
+    for link in links:
+        await bucket.acquire()
+        res = await call_api("revokeChatInviteLink", {"chat_id": settings.private_group_id, "invite_link": link})
+        # 400: already expired or revoked.
+        if res.ok or res.error_code == 400:
+            continue
+        if res.retry_after:
+            await bucket.pause(res.retry_after)
+        failed.append(link)
+    await requeue_revoke(failed)
+    if links:
+        logger.info("Invite pool: %s retired, %s revoked, %s to retry", retired, len(links) - len(failed), len(failed))
+
+
+async def _refill(bucket: RedisTokenBucket) -> None:
+    missing = settings.invite_pool_size - await pool_size()
+    created = 0
+    for _ in range(max(missing, 0)):
+        await bucket.acquire()
+        res = await create_pooled_link()
+        if not res.ok:
+            if res.retry_after:
+                await bucket.pause(res.retry_after)
+            logger.warning("Invite pool refill stopped: %s", res.description)
+            break
+        created += 1
+    if created:
+        logger.info("Invite pool: %s links created", created)
+
+
+async def _maintain_invite_pool_impl() -> None:
+    bucket = shared_bucket()
+    await _revoke_aged(bucket)
+    await _refill(bucket)
+
+
+@celery_app.task
+def maintain_invite_pool() -> None:
+    run_async(_maintain_invite_pool_impl())
@@ -0,0 +1,52 @@
+"""
+Outbox relay: publishes committed outbox events as Celery tasks, in batches.
+"""
+import asyncio
+import logging
+
+from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
+from app.core.outbox import SUBSCRIPTION_INVITE, take_outbox_batch
+from app.db.session import async_session_maker
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# event_type -> Celery task; the payload and the event id (outbox_id) are passed as task kwargs.
+EVENT_TASKS = {
+    SUBSCRIPTION_INVITE: "app.tasks.after_payment.send_subscription_invite",
+}
+
+
+def _publish(events: list) -> None:
+    # Broker publishing is blocking I/O; it runs in a thread off the runtime loop.
+    with celery_app.producer_or_acquire() as producer:
+        for event in events:
+            task = EVENT_TASKS.get(event.event_type)
+            if task is None:
+                logger.error("Outbox event id=%s has unknown type %s, dropped", event.id, event.event_type)
+                continue
+            celery_app.send_task(task, kwargs={**event.payload, "outbox_id": event.id}, producer=producer)
+
+
+async def _relay_outbox_impl() -> None:
+    total = 0
+    while True:
+        async with async_session_maker() as db:
+            events = await take_outbox_batch(db, settings.outbox_batch_size)
+            if not events:
+                break
+            # On failure the transaction rolls back and the events stay in the table.
+            await asyncio.to_thread(_publish, events)
+            await db.commit()
+        total += len(events)
+        if len(events) < settings.outbox_batch_size:
+            break
+    if total:
+        logger.info("Outbox relay published %s events", total)
+
+
+@celery_app.task
+def relay_outbox() -> None:
+    run_async(_relay_outbox_impl())
@@ -0,0 +1,114 @@
+"""
+Payment stream consumer: processes webhook events from the Redis stream in batches.
+"""
+import json
+import logging
+import os
+import socket
+
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
+from app.core.entitlements import invalidate_committed
+from app.core.payment_stream import (
+    StreamEntry,
+    ack,
+    dead_letter,
+    delivery_counts,
+    ensure_group,
+    read_batch,
+    record_batch,
+)
+from app.core.payments import PaymentWebhookPayload, payload_from_webhook, process_payment_batch
+from app.db.session import async_session_maker
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def _payload(entry: StreamEntry) -> PaymentWebhookPayload:
+    _, fields = entry
+    return payload_from_webhook(json.loads(fields["body"]), fields.get("provider") or settings.payment_provider)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection-level failures: the events are fine, the database or Redis is not."""
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, (OSError, RedisConnectionError, RedisTimeoutError))
+
+
+async def _process(payloads: list[PaymentWebhookPayload]) -> None:
+    async with async_session_maker() as db:
+        await process_payment_batch(db, payloads)
+        await db.commit()
+        await invalidate_committed(db)
+
+
+async def _process_batch(entries: list[StreamEntry]) -> bool:
+    """Process, ack or park a batch; False if the database is unavailable and the run should stop.
+
+    Entries left unacked are redelivered by read_batch once they have been idle for
+    PAYMENT_STREAM_CLAIM_IDLE seconds.
+    """
+    parsed: list[tuple[StreamEntry, PaymentWebhookPayload]] = []
+    for entry in entries:
+        try:
+            parsed.append((entry, _payload(entry)))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Payment stream entry %s is malformed: %s", entry[0], e)
+            await dead_letter(entry, repr(e))
+    if not parsed:
+        return True
+    try:
+        await _process([payload for _, payload in parsed])
+    except Exception as e:
+        if _is_transient(e):
+            logger.warning("Payment batch of %s left pending: %s", len(parsed), e)
+            return False
+        # Find the events that break the batch: retry one by one; park only those that keep failing.
+        logger.warning("Payment batch of %s failed (%s), retrying one by one", len(parsed), e)
+        deliveries = await delivery_counts([entry[0] for entry, _ in parsed])
+        for entry, payload in parsed:
+            try:
+                await _process([payload])
+            except Exception as entry_error:
+                if _is_transient(entry_error):
+                    logger.warning("Payment stream entry %s left pending: %s", entry[0], entry_error)
+                    return False
+                if deliveries.get(entry[0], 0) >= settings.payment_stream_max_deliveries:
+                    logger.exception("Payment stream entry %s failed, moved to the dead stream", entry[0])
+                    await dead_letter(entry, repr(entry_error))
+                else:
+                    logger.warning("Payment stream entry %s failed, will be redelivered: %s", entry[0], entry_error)
+                continue
+            await ack([entry[0]])
+        return True
+    await ack([entry[0] for entry, _ in parsed])
+    return True
+
+
+async def _consume_impl() -> None:
+    await ensure_group()
+    # One consumer per worker process; evaluated here, after the prefork.
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    total = 0
+    while total < settings.payment_stream_max_per_run:
+        entries = await read_batch(consumer, settings.payment_stream_batch_size)
+        if not entries:
+            break
+        healthy = await _process_batch(entries)
+        await record_batch(entries)
+        total += len(entries)
+        if not healthy:
+            break
+    if total:
+        logger.info("Payment stream: %s events processed", total)
+
+
+@celery_app.task
+def consume_payment_stream() -> None:
+    run_async(_consume_impl())
@@ -0,0 +1,87 @@
+"""
+Long-lived asyncio runtime for Celery worker processes.
+
+Every async task runs on one event loop per worker process, so the SQLAlchemy/asyncpg pool,
+the Redis client, the Telegram HTTP client and the aiogram Bot session survive between tasks.
+The loop runs in a daemon thread, which also keeps it usable from the threads pool.
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Coroutine, Optional, TypeVar
+
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread, _pid
+    with _lock:
+        # After a fork the parent's loop thread does not exist in the child.
+        if _loop is None or _loop.is_closed() or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="task-runtime", daemon=True)
+            _thread.start()
+            _pid = os.getpid()
+        return _loop
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the worker's persistent loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+async def _dispose_resources() -> None:
+    from app.bot.loader import close_bot
+    from app.db.session import engine
+    from app.services.redis_client import close_redis
+    from app.services.telegram_api import close_client
+
+    for close in (close_client, close_redis, close_bot, engine.dispose):
+        try:
+            await close()
+        except Exception as e:
+            logger.warning("Runtime shutdown: %s failed: %s", getattr(close, "__name__", close), e)
+
+
+def shutdown() -> None:
+    global _loop, _thread
+    with _lock:
+        loop, thread, _loop, _thread = _loop, _thread, None, None
+    if loop is None or loop.is_closed() or _pid != os.getpid():
+        return
+    asyncio.run_coroutine_threadsafe(_dispose_resources(), loop).result(timeout=30)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.close()
+    logger.info("Task runtime stopped")
+
+
+@worker_process_init.connect
+def _on_worker_process_init(**_: Any) -> None:
+    from app.db.session import engine
+    from app.services.redis_client import startup_redis
+
+    # Pooled DB connections inherited from the parent process must not be reused after fork.
+    engine.sync_engine.dispose(close=False)
+    run_async(startup_redis())
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(**_: Any) -> None:
+    shutdown()
+
+
+@worker_shutdown.connect
+def _on_worker_shutdown(**_: Any) -> None:
+    # The solo/threads pools do not fire worker_process_shutdown.
+    shutdown()
@@ -1,25 +1,93 @@
 """
-Delayed scenario step: run after N hours/days.
+Delayed scenario steps: run after N hours/days.
+
+Steps with a `delay` are kept in the Redis delay store (core/scenario_delays.py);
+`dispatch_delayed_steps` runs from Celery beat and sends due steps in batches.
 """
 import asyncio
 import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
 
 from app.tasks.celery_app import celery_app
-from app.core.scenarios import send_step
+from app.tasks.runtime import run_async
+from app.core.entitlements import has_entitlement
+from app.core.scenario_delays import DueStep, claim_due_steps, record_dispatch, schedule_step
+from app.core.scenarios import ScenarioValidationError, get_compiled_scenario, run_delayed_step, send_step
+from app.db.session import async_session_maker
+from app.services.rate_limit import RedisTokenBucket
+from app.services.telegram_sender import shared_bucket
 from app.bot.loader import get_bot
+from app.config import get_settings
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 
 @celery_app.task
 def run_delayed_scenario_step(telegram_id: int, step: dict) -> None:
+    """Legacy countdown/eta entry point, kept for tasks already sitting in the broker."""
     async def _run():
         bot = get_bot()
         await send_step(bot, telegram_id, step)
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    run_async(_run())
+
+
+async def _dispatch_one(due: DueStep) -> None:
+    async with async_session_maker() as db:
+        try:
+            scenario = await get_compiled_scenario(db, due.scenario_id)
+        except ScenarioValidationError as e:
+            logger.error("Delayed step dropped, scenario %s is invalid: %s", due.scenario_id, e)
+            return
+        if scenario is None:
+            return
+        if scenario.subscription_required and not await has_entitlement(db, due.user_id):
+            return
+        if not await run_delayed_step(db, get_bot(), scenario, due.user_id, due.telegram_id, due.step_id):
+            logger.info("Delayed step %s no longer in scenario %s", due.step_id, due.scenario_id)
+
+
+async def _dispatch_safe(due: DueStep, bucket: RedisTokenBucket) -> None:
     try:
-        loop.run_until_complete(_run())
-    finally:
-        loop.close()
+        await _dispatch_one(due)
+    except TelegramRetryAfter as e:
+        await schedule_step(due.user_id, due.scenario_id, due.telegram_id, due.step_id, time.time() + e.retry_after)
+        # Flood control applies to the whole bot: hold every sender, as TelegramSender.send does.
+        logger.warning("Flood control: retry_after=%ss (chat %s)", e.retry_after, due.telegram_id)
+        await bucket.pause(e.retry_after)
+    except TelegramForbiddenError:
+        logger.info("Delayed step to %s dropped: bot blocked", due.telegram_id)
+    except Exception as e:
+        logger.warning("Delayed step %s for user %s failed: %s", due.step_id, due.user_id, e)
+
+
+async def _dispatch_due_impl() -> None:
+    bucket = shared_bucket()
+    total = 0
+    while True:
+        batch = await claim_due_steps(time.time(), settings.scenario_delay_batch_size)
+        if not batch:
+            break
+        it = iter(batch)
+
+        async def worker() -> None:
+            for due in it:
+                await bucket.acquire()
+                await _dispatch_safe(due, bucket)
+
+        await asyncio.gather(*(worker() for _ in range(settings.broadcast_concurrency)))
+        # Measured once the batch is sent, so time spent waiting on the rate limit counts as lag.
+        await record_dispatch(time.time(), batch)
+        total += len(batch)
+        if len(batch) < settings.scenario_delay_batch_size:
+            break
+    if total:
+        logger.info("Delayed steps dispatched: %s", total)
+
+
+@celery_app.task
+def dispatch_delayed_steps() -> None:
+    run_async(_dispatch_due_impl())
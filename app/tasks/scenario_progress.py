@@ -0,0 +1,30 @@
+"""
+Write-behind of scenario progress: copies steps changed in Redis to user_scenario_progress.
+"""
+import logging
+
+from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
+from app.db.session import async_session_maker
+from app.core.scenario_state import flush_dirty_progress
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+async def _flush_progress_impl() -> None:
+    total = 0
+    while True:
+        async with async_session_maker() as db:
+            flushed = await flush_dirty_progress(db, settings.scenario_flush_batch_size)
+        total += flushed
+        if flushed < settings.scenario_flush_batch_size:
+            break
+    if total:
+        logger.info("Scenario progress flushed: %s entries", total)
+
+
+@celery_app.task
+def flush_scenario_progress() -> None:
+    run_async(_flush_progress_impl())
@@ -1,49 +1,145 @@
-import asyncio
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 from sqlalchemy import select
 
 from app.tasks.celery_app import celery_app
+from app.tasks.runtime import run_async
 from app.db.session import async_session_maker
-from app.db.models import User, Subscription
+from app.db.models import Subscription, User
 from app.db.models.subscription import SubscriptionStatus
-from app.services.telegram_api import kick_chat_member, send_message
+from app.core.entitlements import invalidate_entitlements
+from app.core.expiry_schedule import claim_due, schedule_expiries
+from app.core.subscription import ExpiredSubscription, expire_due_subscriptions
+from app.services.redis_client import get_redis
+from app.services.telegram_api import ban_chat_member_result, send_message_result
+from app.services.telegram_sender import TelegramSender, retryable_error, shared_bucket
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+EXPIRED_MESSAGE = "Ваша подписка истекла. Спасибо, что были с нами! Продлить подписку можно в боте."
+# telegram_id -> user_id of users whose removal from the group failed transiently; retried daily.
+KICK_RETRY_KEY = "subscription_expiry:kick_retry"
+# The daily sweep re-registers everything ending before its next run in the timer.
+SWEEP_LOOKAHEAD = timedelta(days=2)
 
-def _run_async(coro):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
 
+async def _kick(telegram_id: int):
+    return await ban_chat_member_result(settings.private_group_id, telegram_id)
 
-async def _expire_subscriptions_impl() -> None:
+
+async def _offboard(sender: TelegramSender, expired: list[ExpiredSubscription]) -> None:
+    """Remove users from the group and notify them; kicks that failed transiently are queued for retry."""
+    await invalidate_entitlements({e.user_id for e in expired})
+    # A prepaid renewal starts where this subscription ended: those users keep access.
+    leaving = {e.telegram_id: e.user_id for e in expired if not e.renewed}
+    if not leaving:
+        return
+    kicks = await sender.send_many(leaving, _kick)
+    failed = [d for d in kicks if not d.ok]
+    retry = {d.chat_id: leaving[d.chat_id] for d in failed if retryable_error(d.error_code)}
+    if retry:
+        await get_redis().hset(KICK_RETRY_KEY, mapping=retry)
+    if failed:
+        # 400/403 (user never joined, bot lost admin rights) will not succeed on retry.
+        logger.warning("Expiry: %s kicks failed, %s queued for retry", len(failed), len(retry))
+    await sender.send_many(leaving, lambda chat_id: send_message_result(chat_id, EXPIRED_MESSAGE))
+
+
+async def _retry_failed_kicks(sender: TelegramSender) -> None:
+    redis = get_redis()
+    pending = {int(tg): int(uid) for tg, uid in (await redis.hgetall(KICK_RETRY_KEY)).items()}
+    if not pending:
+        return
     now = datetime.now(timezone.utc)
     async with async_session_maker() as db:
         result = await db.execute(
-            select(Subscription)
-            .where(Subscription.status == SubscriptionStatus.active, Subscription.end_date <= now)
+            select(User.telegram_id)
+            .join(Subscription)
+            .where(
+                User.telegram_id.in_(pending),
+                Subscription.status == SubscriptionStatus.active,
+                Subscription.end_date > now,
+            )
         )
-        subs = result.scalars().all()
-        for sub in subs:
-            sub.status = SubscriptionStatus.expired
-            user = (await db.execute(select(User).where(User.id == sub.user_id))).scalar_one()
-            await kick_chat_member(settings.private_group_id, user.telegram_id)
-            await send_message(
-                user.telegram_id,
-                "Ваша подписка истекла. Спасибо, что были с нами! Продлить подписку можно в боте.",
+        resubscribed = set(result.scalars().all())
+    to_kick = [tg for tg in pending if tg not in resubscribed]
+    kicks = await sender.send_many(to_kick, _kick)
+    dropped = [d for d in kicks if not d.ok and not retryable_error(d.error_code)]
+    for d in dropped:
+        logger.warning("Expiry: kick of %s failed with %s, not retrying", d.chat_id, d.error_code)
+    done = resubscribed | {d.chat_id for d in dropped} | {d.chat_id for d in kicks if d.ok}
+    if done:
+        await redis.hdel(KICK_RETRY_KEY, *done)
+    logger.info("Expiry: retried %s kicks, %s still failing", len(to_kick), len(pending) - len(done))
+
+
+async def expire_batches(subscription_ids: Optional[list[int]] = None) -> int:
+    """Expire due subscriptions batch by batch; each batch is committed before offboarding."""
+    sender = TelegramSender.from_settings(shared_bucket())
+    total = 0
+    while True:
+        async with async_session_maker() as db:
+            expired = await expire_due_subscriptions(
+                db, datetime.now(timezone.utc), settings.expiry_batch_size, subscription_ids,
+            )
+            await db.commit()
+        if not expired:
+            break
+        total += len(expired)
+        logger.info("Expired %s subscriptions (ids %s..%s)", len(expired), expired[0].subscription_id, expired[-1].subscription_id)
+        await _offboard(sender, expired)
+        if len(expired) < settings.expiry_batch_size:
+            break
+    return total
+
+
+async def _schedule_upcoming() -> None:
+    """Backfill the timer with subscriptions it may have missed (created before it existed, Redis down)."""
+    now = datetime.now(timezone.utc)
+    async with async_session_maker() as db:
+        result = await db.execute(
+            select(Subscription.id, Subscription.end_date).where(
+                Subscription.status == SubscriptionStatus.active,
+                Subscription.end_date > now,
+                Subscription.end_date <= now + SWEEP_LOOKAHEAD,
             )
-            logger.info("Expired subscription id=%s user_id=%s", sub.id, sub.user_id)
-        await db.commit()
+        )
+        upcoming = result.all()
+    await schedule_expiries(upcoming)
+    logger.info("Expiry timer: %s upcoming subscriptions scheduled", len(upcoming))
+
+
+async def _expire_subscriptions_impl() -> None:
+    await _retry_failed_kicks(TelegramSender.from_settings(shared_bucket()))
+    total = await expire_batches()
+    await _schedule_upcoming()
+    logger.info("Expiry run done: %s subscriptions expired", total)
+
+
+async def _poll_expiry_impl() -> None:
+    # Failed kicks are retried by the daily sweep only, not on every poll.
+    total = 0
+    while True:
+        ids = await claim_due(datetime.now(timezone.utc), settings.expiry_batch_size)
+        if not ids:
+            break
+        # Ids claimed but not expired here (already expired, locked by the sweep) need no retry.
+        total += await expire_batches(ids)
+        if len(ids) < settings.expiry_batch_size:
+            break
+    if total:
+        logger.info("Expiry poll done: %s subscriptions expired", total)
 
 
 @celery_app.task
 def expire_subscriptions() -> None:
-    _run_async(_expire_subscriptions_impl())
+    run_async(_expire_subscriptions_impl())
+
+
+@celery_app.task
+def poll_subscription_expiry() -> None:
+    run_async(_poll_expiry_impl())